@@ -0,0 +1,247 @@
+import threading
+import hashlib
+import base64
+import logging
+import sqlite3
+import shutil
+import json
+import time
+import os
+
+
+class CacheManager:
+    """Content-addressed cache of downloaded files with a byte budget.
+
+    Each distinct content is stored once under CACHE_PATH/objects/<ab>/<sha256>, and CACHE_PATH/<cloud_path>
+    is a hard link to it (a copy where links are unavailable). A single SQLite index at
+    CACHE_PATH/meta/index.sqlite maps cloud paths to blobs and to the metadata they were downloaded with.
+    Once the cache holds more than max_bytes, the least recently used entries are evicted.
+    """
+    logger = logging.getLogger("CacheManager")
+    #Used when neither max_bytes nor CACHE_MAX_BYTES is given
+    default_max_bytes:int = 2147483648
+    hash_block_size:int = 1048576
+
+    def __init__(self, root:str=None, max_bytes:int=None):
+        self.root = root
+        self.max_bytes = max_bytes if (max_bytes is not None) else int(os.environ.get("CACHE_MAX_BYTES", self.default_max_bytes))
+        self.lock = threading.Lock()
+        self.db:sqlite3.Connection = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def cache_root(self) -> str:
+        return self.root if (self.root) else os.environ.get("CACHE_PATH")
+
+    def path(self, cloud_path:str) -> str:
+        return f"{self.cache_root()}/{cloud_path.strip('/')}"
+
+    def blob_path(self, digest:str) -> str:
+        return f"{self.cache_root()}/objects/{digest[:2]}/{digest}"
+
+    def connect(self) -> sqlite3.Connection:
+        #Called with self.lock held
+        if (self.db is None):
+            index = f"{self.cache_root()}/meta/index.sqlite"
+            os.makedirs(os.path.dirname(index), exist_ok=True)
+            self.db = sqlite3.connect(index, check_same_thread=False, isolation_level=None)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("CREATE TABLE IF NOT EXISTS blobs (digest TEXT PRIMARY KEY, size INTEGER NOT NULL)")
+            self.db.execute("CREATE TABLE IF NOT EXISTS entries (cloud_path TEXT PRIMARY KEY, digest TEXT NOT NULL REFERENCES blobs(digest), "
+                            "meta TEXT NOT NULL, etag TEXT, copied INTEGER NOT NULL DEFAULT 0, last_used REAL NOT NULL)")
+            self.db.execute("CREATE INDEX IF NOT EXISTS entries_last_used ON entries(last_used)")
+            self.db.execute("CREATE INDEX IF NOT EXISTS entries_digest ON entries(digest)")
+            self.db.execute("CREATE TABLE IF NOT EXISTS signatures (cloud_path TEXT PRIMARY KEY, md5 TEXT NOT NULL, blocks TEXT NOT NULL)")
+        return self.db
+
+    def lookup(self, cloud_path:str, meta:dict) -> str:
+        """Path of the cached file if it holds the content meta describes, otherwise None."""
+        cloud_path = cloud_path.strip("/")
+        with self.lock:
+            db = self.connect()
+            row = db.execute("SELECT digest, meta FROM entries WHERE cloud_path = ?", (cloud_path,)).fetchone()
+            if (row is None or not self.matches(json.loads(row[1]), meta) or not os.path.exists(self.blob_path(row[0]))):
+                self.misses += 1
+                return None
+            self.hits += 1
+            return self.touch(db, cloud_path, row[0], meta)
+
+    def refresh(self, cloud_path:str, meta:dict) -> str:
+        """Records that the cached content is still current under new metadata, e.g. after a 304."""
+        cloud_path = cloud_path.strip("/")
+        with self.lock:
+            db = self.connect()
+            row = db.execute("SELECT digest FROM entries WHERE cloud_path = ?", (cloud_path,)).fetchone()
+            if (row is None or not os.path.exists(self.blob_path(row[0]))):
+                return None
+            self.hits += 1
+            return self.touch(db, cloud_path, row[0], meta)
+
+    def touch(self, db:sqlite3.Connection, cloud_path:str, digest:str, meta:dict) -> str:
+        path = self.path(cloud_path)
+        if (not os.path.exists(path)):
+            copied = self.materialize(self.blob_path(digest), path)
+            db.execute("UPDATE entries SET copied = ? WHERE cloud_path = ?", (int(copied), cloud_path))
+        db.execute("UPDATE entries SET meta = ?, last_used = ? WHERE cloud_path = ?", (json.dumps(meta), time.time(), cloud_path))
+        return path
+
+    def etag(self, cloud_path:str) -> str:
+        """ETag the cached copy was downloaded with, for a conditional request."""
+        with self.lock:
+            row = self.connect().execute("SELECT etag, digest FROM entries WHERE cloud_path = ?", (cloud_path.strip("/"),)).fetchone()
+        return row[0] if (row and os.path.exists(self.blob_path(row[1]))) else None
+
+    @staticmethod
+    def matches(cached:dict, meta:dict) -> bool:
+        """Same content: compared by hash when both sides have one, otherwise by modification time."""
+        if (cached.get("md5") and meta.get("md5")):
+            return cached["md5"] == meta["md5"]
+        return cached.get("modified") == meta.get("modified", "")
+
+    def admit(self, cloud_path:str, meta:dict, etag:str=None) -> str:
+        """Moves a freshly downloaded CACHE_PATH/<cloud_path> into the object store and records it.
+
+        A file whose MD5 differs from the one in meta, e.g. one another process was still writing, is
+        deleted instead of being stored under the wrong content.
+        """
+        cloud_path = cloud_path.strip("/")
+        path = self.path(cloud_path)
+        digest, size, md5 = self.digest(path)
+        if (meta.get("md5") and md5 != meta["md5"]):
+            os.remove(path)
+            raise Exception(f"Downloaded content of {cloud_path} does not match its metadata")
+        blob = self.blob_path(digest)
+        with self.lock:
+            db = self.connect()
+            if (os.path.exists(blob)):
+                #Same content is already stored; keep one copy
+                os.remove(path)
+            else:
+                os.makedirs(os.path.dirname(blob), exist_ok=True)
+                os.replace(path, blob)
+            copied = self.materialize(blob, path)
+            db.execute("BEGIN")
+            try:
+                db.execute("INSERT OR IGNORE INTO blobs (digest, size) VALUES (?, ?)", (digest, size))
+                previous = db.execute("SELECT digest FROM entries WHERE cloud_path = ?", (cloud_path,)).fetchone()
+                db.execute("INSERT OR REPLACE INTO entries (cloud_path, digest, meta, etag, copied, last_used) VALUES (?, ?, ?, ?, ?, ?)",
+                           (cloud_path, digest, json.dumps(meta), etag, int(copied), time.time()))
+                if (previous and previous[0] != digest):
+                    self.drop_blob(db, previous[0])
+                db.execute("COMMIT")
+            except Exception:
+                db.execute("ROLLBACK")
+                raise
+            self.evict(db, keep=cloud_path)
+        return path
+
+    def signature(self, cloud_path:str, md5:str) -> list[list]:
+        """Digest, offset and length of each block of the last delta upload of the file, if the stored object is still that version."""
+        with self.lock:
+            row = self.connect().execute("SELECT md5, blocks FROM signatures WHERE cloud_path = ?", (cloud_path.strip("/"),)).fetchone()
+        if (not row or not md5 or row[0] != md5):
+            return None
+        blocks = json.loads(row[1])
+        #Older rows hold bare digests, which can't be matched by offset
+        return blocks if (all(isinstance(block, list) for block in blocks)) else None
+
+    def has_signature(self, cloud_path:str) -> bool:
+        """Whether this client delta-uploaded the file before, whatever version that was."""
+        with self.lock:
+            return self.connect().execute("SELECT 1 FROM signatures WHERE cloud_path = ?", (cloud_path.strip("/"),)).fetchone() is not None
+
+    def store_signature(self, cloud_path:str, md5:str, blocks:list[list]):
+        with self.lock:
+            self.connect().execute("INSERT OR REPLACE INTO signatures (cloud_path, md5, blocks) VALUES (?, ?, ?)", (cloud_path.strip("/"), md5, json.dumps(blocks)))
+
+    def remove(self, cloud_path:str):
+        """Forgets the entry and deletes its file, e.g. after the cloud file is deleted."""
+        cloud_path = cloud_path.strip("/")
+        with self.lock:
+            db = self.connect()
+            db.execute("DELETE FROM signatures WHERE cloud_path = ?", (cloud_path,))
+            row = db.execute("SELECT digest FROM entries WHERE cloud_path = ?", (cloud_path,)).fetchone()
+            if (row is None):
+                return
+            self.drop_entry(db, cloud_path, row[0])
+
+    def used_bytes(self, db:sqlite3.Connection) -> int:
+        #Blobs count once; entries that could not be linked hold a second copy
+        blobs = db.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+        copies = db.execute("SELECT COALESCE(SUM(blobs.size), 0) FROM entries JOIN blobs USING (digest) WHERE entries.copied = 1").fetchone()[0]
+        return blobs + copies
+
+    def evict(self, db:sqlite3.Connection, keep:str=None):
+        used = self.used_bytes(db)
+        while (used > self.max_bytes):
+            row = db.execute("SELECT cloud_path, digest FROM entries WHERE cloud_path != ? ORDER BY last_used LIMIT 1", (keep or "",)).fetchone()
+            if (row is None):
+                break
+            self.drop_entry(db, row[0], row[1])
+            self.evictions += 1
+            self.logger.info(f"Evicted {row[0]} from the cache")
+            used = self.used_bytes(db)
+
+    def drop_entry(self, db:sqlite3.Connection, cloud_path:str, digest:str):
+        path = self.path(cloud_path)
+        blob = self.blob_path(digest)
+        row = db.execute("SELECT copied FROM entries WHERE cloud_path = ?", (cloud_path,)).fetchone()
+        #Leave the file alone if it was replaced since it was cached, e.g. saved from the editor
+        try:
+            if (os.path.samefile(path, blob) or (row and row[0] and self.digest(path)[0] == digest)):
+                os.remove(path)
+        except FileNotFoundError:
+            pass
+        db.execute("DELETE FROM entries WHERE cloud_path = ?", (cloud_path,))
+        self.drop_blob(db, digest)
+
+    def drop_blob(self, db:sqlite3.Connection, digest:str):
+        if (db.execute("SELECT 1 FROM entries WHERE digest = ? LIMIT 1", (digest,)).fetchone()):
+            return
+        db.execute("DELETE FROM blobs WHERE digest = ?", (digest,))
+        try:
+            os.remove(self.blob_path(digest))
+        except FileNotFoundError:
+            pass
+
+    def stats(self) -> dict:
+        with self.lock:
+            db = self.connect()
+            entries = db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+            return {'hits':self.hits, 'misses':self.misses, 'evictions':self.evictions,
+                    'entries':entries, 'bytes':self.used_bytes(db), 'max_bytes':self.max_bytes}
+
+    def close(self):
+        with self.lock:
+            if (self.db is not None):
+                self.db.close()
+                self.db = None
+
+    @staticmethod
+    def materialize(blob:str, path:str) -> bool:
+        """Links path to the blob; returns True when it had to fall back to a copy."""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        try:
+            os.link(blob, path)
+            return False
+        except OSError:
+            shutil.copyfile(blob, path)
+            return True
+
+    @classmethod
+    def digest(cls, path:str) -> tuple[str, int, str]:
+        """sha256 that names the blob, size, and base64 MD5 in the form owned_files records it."""
+        sha = hashlib.sha256()
+        md5 = hashlib.md5()
+        size = 0
+        with open(path, 'rb') as f:
+            while (block := f.read(cls.hash_block_size)):
+                sha.update(block)
+                md5.update(block)
+                size += len(block)
+        return sha.hexdigest(), size, base64.b64encode(md5.digest()).decode()
@@ -0,0 +1,132 @@
+from objects import User
+from transport import shared_session
+from urllib.parse import quote
+import threading
+import logging
+import socket
+import requests
+import uuid
+import time
+import json
+import os
+
+
+class CloudLockHeld(Exception):
+    pass
+
+
+class CloudLease:
+    """Advisory lease on one cloud file, kept in the lock child of its owned_files node.
+
+    Every write is conditional on the ETag the Realtime Database returned for the lock, so of two
+    clients racing for it exactly one wins. The holder renews the lease in the background; a client
+    that crashes stops renewing and its lease can be taken once it expires.
+    """
+    logger = logging.getLogger("CloudLease")
+    ttl:float = 60
+    poll_interval:float = 1
+    held:bool = False
+    #Set when a renewal finds the lease taken over, e.g. after this client was offline past the TTL
+    lost:bool = False
+
+    def __init__(self, database_url:str, user:User, cloud_path:str, session:requests.Session=None, ttl:float=None):
+        self.database_url = database_url.rstrip("/")
+        self.user = user
+        self.cloud_path = cloud_path.strip("/")
+        self.session = session if (session) else shared_session()
+        if (ttl):
+            self.ttl = ttl
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex}"
+        self.stopped = threading.Event()
+        self.renewer:threading.Thread = None
+
+    def url(self) -> str:
+        keys = [quote(key.replace(".", "&123"), safe='') for key in self.cloud_path.split("/") if (key)]
+        return f"{self.database_url}/users/{self.user.localId}/owned_files/{'/'.join(keys)}/lock.json"
+
+    def record(self) -> dict:
+        return {'owner':self.owner, 'holder':self.user.email, 'host':socket.gethostname(), 'expires':time.time() + self.ttl}
+
+    def read(self) -> tuple[dict, str]:
+        result = self.session.get(self.url(), params={'auth':self.user.idToken}, headers={'X-Firebase-ETag':'true'})
+        if (not result.ok):
+            raise Exception(f"Failed to read the lock of {self.cloud_path}: {result.status_code}")
+        return result.json(), result.headers.get('ETag')
+
+    def write(self, value:dict, etag:str) -> tuple[bool, dict, str]:
+        """Replaces the lock only if it still has etag; otherwise returns the current value and ETag."""
+        if (etag is None):
+            #Without if-match the write would be unconditional
+            raise Exception(f"No ETag for the lock of {self.cloud_path}")
+        result = self.session.put(self.url(), params={'auth':self.user.idToken}, headers={'X-Firebase-ETag':'true', 'if-match':etag}, data=json.dumps(value))
+        if (result.status_code == 412):
+            return False, result.json(), result.headers.get('ETag')
+        if (not result.ok):
+            raise Exception(f"Failed to write the lock of {self.cloud_path}: {result.status_code}")
+        return True, value, result.headers.get('ETag')
+
+    def available(self, value:dict) -> bool:
+        return not isinstance(value, dict) or value.get('owner') == self.owner or value.get('expires', 0) < time.time()
+
+    def acquire(self, timeout:float=0) -> "CloudLease":
+        """Takes the lease, waiting up to timeout seconds for another holder to release it or let it expire."""
+        deadline = time.monotonic() + timeout
+        value, etag = self.read()
+        while (True):
+            if (self.available(value)):
+                written, value, etag = self.write(self.record(), etag)
+                if (written):
+                    break
+                continue
+            remaining = deadline - time.monotonic()
+            if (remaining <= 0):
+                raise CloudLockHeld(f"{self.cloud_path} is being edited by {value.get('holder', 'another client')} on {value.get('host', 'another host')}")
+            time.sleep(min(self.poll_interval, remaining))
+            value, etag = self.read()
+        self.held = True
+        self.lost = False
+        self.stopped.clear()
+        self.renewer = threading.Thread(target=self.renew_loop, name=f"lease-{self.cloud_path}", daemon=True)
+        self.renewer.start()
+        return self
+
+    def renew(self) -> bool:
+        value, etag = self.read()
+        while (isinstance(value, dict) and value.get('owner') == self.owner):
+            written, value, etag = self.write(self.record(), etag)
+            if (written):
+                return True
+        return False
+
+    def renew_loop(self):
+        while (not self.stopped.wait(self.ttl / 3)):
+            try:
+                if (not self.renew()):
+                    self.lost = True
+                    self.held = False
+                    self.logger.warning(f"Lease on {self.cloud_path} was taken over")
+                    return
+            except Exception as e:
+                #Keep trying; the lease only lapses if renewals fail for a whole TTL
+                self.logger.warning(f"Could not renew the lease on {self.cloud_path}: {e}")
+
+    def release(self):
+        self.stopped.set()
+        if (not self.held):
+            return
+        self.held = False
+        try:
+            value, etag = self.read()
+            while (isinstance(value, dict) and value.get('owner') == self.owner):
+                written, value, etag = self.write(None, etag)
+                if (written):
+                    break
+        except Exception as e:
+            #An unreleased lease expires on its own after the TTL
+            self.logger.warning(f"Could not release the lease on {self.cloud_path}: {e}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
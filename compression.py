@@ -0,0 +1,76 @@
+import tempfile
+import hashlib
+import base64
+import zlib
+import os
+
+#Formats that are already compressed; gzip would only cost time
+INCOMPRESSIBLE_EXTENSIONS:set[str] = {
+    ".gz", ".tgz", ".zip", ".7z", ".rar", ".bz2", ".xz", ".zst", ".lz4",
+    ".jpg", ".jpeg", ".png", ".gif", ".webp", ".heic", ".mp3", ".aac", ".ogg", ".flac",
+    ".mp4", ".mkv", ".avi", ".mov", ".webm", ".pdf", ".docx", ".xlsx", ".pptx", ".jar", ".apk",
+}
+min_size:int = 1024
+#Compress only when a sample shrinks to at most this fraction of its size
+max_ratio:float = 0.9
+sample_size:int = 65536
+block_size:int = 1048576
+
+
+def should_compress(path:str) -> bool:
+    """Guesses from the extension and a few compressed samples whether gzip is worth it."""
+    if (os.path.splitext(path)[1].lower() in INCOMPRESSIBLE_EXTENSIONS):
+        return False
+    size = os.path.getsize(path)
+    if (size < min_size):
+        return False
+    sampled = 0
+    compressed = 0
+    with open(path, 'rb') as f:
+        #Start, middle and end, so a text header on binary content doesn't decide alone
+        for offset in sorted({0, max(0, size // 2 - sample_size // 2), max(0, size - sample_size)}):
+            f.seek(offset)
+            sample = f.read(sample_size)
+            sampled += len(sample)
+            compressed += len(zlib.compress(sample, 1))
+    return compressed <= sampled * max_ratio
+
+
+def compress_file(path:str, directory:str) -> tuple[str, str]:
+    """Gzips path into a new file in directory; returns its path and the base64 MD5 of the compressed bytes."""
+    os.makedirs(directory, exist_ok=True)
+    fd, staged = tempfile.mkstemp(dir=directory, suffix=".gz")
+    md5 = hashlib.md5()
+    #wbits 31 writes the gzip header and trailer
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    try:
+        with open(path, 'rb') as source, os.fdopen(fd, 'wb') as target:
+            while (block := source.read(block_size)):
+                data = compressor.compress(block)
+                md5.update(data)
+                target.write(data)
+            data = compressor.flush()
+            md5.update(data)
+            target.write(data)
+    except Exception:
+        os.remove(staged)
+        raise
+    return staged, base64.b64encode(md5.digest()).decode()
+
+
+def decompress_file(path:str):
+    """Replaces a gzipped file with its content, streaming through a temporary file beside it."""
+    fd, temporary = tempfile.mkstemp(dir=os.path.dirname(path) or '.', prefix='.tmp-')
+    decompressor = zlib.decompressobj(31)
+    try:
+        with open(path, 'rb') as source, os.fdopen(fd, 'wb') as target:
+            while (block := source.read(block_size)):
+                target.write(decompressor.decompress(block))
+            target.write(decompressor.flush())
+        if (not decompressor.eof):
+            raise Exception(f"{path} ends before the end of its gzip stream")
+        os.replace(temporary, path)
+    except Exception:
+        if (os.path.exists(temporary)):
+            os.remove(temporary)
+        raise
@@ -0,0 +1,94 @@
+import hashlib
+import math
+
+#Random 64-bit value per byte for the gear rolling hash, fixed so every client cuts at the same places
+GEAR:list[int] = [int.from_bytes(hashlib.sha256(bytes([i])).digest()[:8], 'big') for i in range(256)]
+MASK64:int = (1 << 64) - 1
+
+
+class Block:
+    """One content-defined block of a file: where it lies and the sha256 that names it."""
+
+    def __init__(self, digest:str, offset:int, length:int):
+        self.digest = digest
+        self.offset = offset
+        self.length = length
+
+    def signature(self) -> list:
+        return [self.digest, self.offset, self.length]
+
+    @classmethod
+    def from_signature(cls, signature:list):
+        return cls(*signature)
+
+
+def average_block_size(size:int, min_average:int=262144, max_blocks:int=512) -> int:
+    """Power of two near size / max_blocks, so large files stay within the compose component limit."""
+    return 1 << max(int(math.log2(min_average)), math.ceil(math.log2(max(1, size) / max_blocks)))
+
+
+def blocks(view, average:int=None, start:int=0, previous:list[Block]=None):
+    """Cuts view into content-defined blocks from start, which must be a block boundary, yielding them in order.
+
+    A gear rolling hash over the bytes since the last cut picks boundaries where its top bits are zero,
+    so an insertion or deletion only changes the blocks around it and later blocks keep their hashes.
+    Blocks are between average / 2 and average * 4 bytes long, apart from the last one.
+
+    The hash runs in Python at a few MB/s, so blocks of the previous version are reused where they still
+    match: first at their own offsets, then shifted by the change in size once a cut lands on one of their
+    starts. Each is checked with sha256 at C speed, and a cut depends only on the bytes since the last
+    one, so the result is the same as hashing the whole view. An append or a single edit then only
+    hashes the blocks around it.
+    """
+    size = len(view)
+    average = average if (average) else average_block_size(size)
+    minimum = average // 2
+    maximum = average * 4
+    bits = int(math.log2(average))
+    mask = ((1 << bits) - 1) << (64 - bits)
+    gear = GEAR
+
+    reusable = {}
+    shift = 0
+    if (previous):
+        previous_size = previous[-1].offset + previous[-1].length
+        #Other averages cut elsewhere
+        if (average_block_size(previous_size) == average):
+            reusable = {block.offset: (index, block) for index, block in enumerate(previous)}
+            shift = size - previous_size
+    last = len(previous) - 1 if (previous) else -1
+
+    def reuse(offset:int, moved:int):
+        """Blocks of the previous version that match from offset, where their old offset is offset - moved."""
+        found = reusable.get(offset - moved)
+        while (found):
+            index, block = found
+            end = offset + block.length
+            #The previous last block was cut by the end of its file, which only holds if it still ends this one
+            if ((index == last and end != size) or end > size or hashlib.sha256(view[offset:end]).hexdigest() != block.digest):
+                return
+            yield Block(block.digest, offset, block.length)
+            offset = end
+            found = reusable.get(offset - moved)
+
+    while (start < size):
+        for block in reuse(start, 0):
+            start += block.length
+            yield block
+        if (shift):
+            for block in reuse(start, shift):
+                start += block.length
+                yield block
+        if (start >= size):
+            break
+        end = min(size, start + maximum)
+        cut = end
+        h = 0
+        #No boundary can fall inside the minimum length, so the hash skips it; view only needs len() and slices
+        for i, byte in enumerate(view[start + minimum:end], start + minimum):
+            h = ((h << 1) + gear[byte]) & MASK64
+            if (not h & mask):
+                cut = i + 1
+                break
+        yield Block(hashlib.sha256(view[start:cut]).hexdigest(), start, cut - start)
+        start = cut
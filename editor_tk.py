@@ -3,17 +3,20 @@ from tkinter import filedialog, messagebox, ttk
 import threading
 import os
 from firebase import Firebase, CustomThread
+from taskpool import shared_pool, TaskPool, TaskPoolFull
 from objects import User
 from scheduling import Computer
 from datetime import datetime
-from locks import acquire_shared_lock, acquire_exclusive_lock, release_lock
+from locks import acquire_shared_lock, acquire_exclusive_lock, release_lock, lock_holder
 from fileops import safe_read, safe_write
 
 class EditorApp:
-    def __init__(self, root, firebase: Firebase = None, user: User = None):
+    def __init__(self, root, firebase: Firebase = None, user: User = None, tasks: TaskPool = None):
         self.root = root
         self.firebase = firebase
         self.user = user
+        # Shared bounded pool for opens, saves, uploads and deletes
+        self.tasks = tasks if tasks else (firebase.tasks if firebase else shared_pool())
         root.title("CloudOS Editor")
 
         # Create main container
@@ -59,6 +62,8 @@ class EditorApp:
         self.current_path = None
         self.current_cloud_path = None
         self.lock = None
+        # Edit lease on the open cloud file, held while it is open in edit mode
+        self.cloud_lock = None
         self.edit_mode = False
         self.is_cloud_file = False
 
@@ -100,8 +105,7 @@ class EditorApp:
                 # ask read or edit
                 mode = messagebox.askquestion("Mode", "Open in edit mode? (No = read-only)", icon='question')
                 self.edit_mode = (mode == 'yes')
-                t = threading.Thread(target=self._open_file, args=(path,), daemon=True)
-                t.start()
+                self._run_background(self._open_file, path)
             else:
                 # Copy to workspace first
                 try:
@@ -117,8 +121,7 @@ class EditorApp:
                     # Now open the workspace copy
                     mode = messagebox.askquestion("Mode", "Open in edit mode? (No = read-only)", icon='question')
                     self.edit_mode = (mode == 'yes')
-                    t = threading.Thread(target=self._open_file, args=(path,), daemon=True)
-                    t.start()
+                    self._run_background(self._open_file, path)
                 except Exception as e:
                     messagebox.showerror("Copy Failed", f"Could not copy file: {e}")
 
@@ -146,8 +149,7 @@ class EditorApp:
         self.edit_mode = True
         self.is_cloud_file = False
         self.current_cloud_path = None
-        t = threading.Thread(target=self._open_file, args=(path,), daemon=True)
-        t.start()
+        self._run_background(self._open_file, path)
 
     def _close_current_file(self):
         """Close the currently open file, releasing locks"""
@@ -157,6 +159,7 @@ class EditorApp:
             except Exception:
                 pass
             self.lock = None
+        self._release_cloud_lock()
         self.current_path = None
         self.current_cloud_path = None
         self.is_cloud_file = False
@@ -164,6 +167,14 @@ class EditorApp:
         self.text.config(state='normal')
         self.save_btn.config(state='disabled')
 
+    def _release_cloud_lock(self):
+        """Give up the edit lease on the current cloud file without blocking the caller"""
+        if self.cloud_lock and self.firebase and self.user:
+            cloud_path = self.cloud_lock.cloud_path
+            self.cloud_lock = None
+            # Not through the task pool: this also runs inside pool tasks, which must not wait for a slot
+            threading.Thread(target=self.firebase.unlock_file, args=(self.user, cloud_path), daemon=True, name="unlock").start()
+
     def _open_file(self, path):
         try:
             # Close current file if one is open
@@ -227,24 +238,13 @@ class EditorApp:
                 else:
                     self.lock = acquire_shared_lock(path, timeout=10)
             except TimeoutError:
-                if messagebox.askyesno("Lock Timeout", 
-                    "File is locked by another process.\nWould you like to force unlock it?"):
-                    # Force unlock by removing the lock file from temp directory
-                    from locks import get_lock_path
-                    lockfile = get_lock_path(path)
-                    if os.path.exists(lockfile):
-                        try:
-                            os.remove(lockfile)
-                            # Retry the lock
-                            if self.edit_mode:
-                                self.lock = acquire_exclusive_lock(path, timeout=5)
-                            else:
-                                self.lock = acquire_shared_lock(path, timeout=5)
-                        except Exception as e:
-                            raise Exception(f"Could not force unlock: {str(e)}")
-                else:
-                    raise
+                # Locks of crashed or expired holders are reclaimed automatically, so this one is live
+                holder = lock_holder(path)
+                if holder and holder.get('pid'):
+                    raise TimeoutError(f"File is locked by process {holder['pid']} on {holder.get('host', 'this machine')}")
+                raise
         except Exception as e:
+            self._release_cloud_lock()
             self._set_status("Access failed")
             messagebox.showerror("Access Error", str(e))
             self.progress.stop()
@@ -273,14 +273,15 @@ class EditorApp:
         self.save_btn.config(state='disabled')
         self._set_status("Saving...")
         self.progress.start()
-        t = threading.Thread(target=self._save_file, args=(self.current_path, data), daemon=True)
-        t.start()
+        if not self._run_background(self._save_file, self.current_path, data):
+            self.save_btn.config(state='normal')
+            self.progress.stop()
 
     def _save_file(self, path, data):
         try:
             # If we have an exclusive lock with portalocker, temporarily release it for writing
             lock_was_held = False
-            if self.lock and self.lock.exclusive and hasattr(self.lock, '_fh') and self.lock._fh:
+            if self.lock and self.lock.exclusive and self.lock.fh:
                 lock_was_held = True
                 # Temporarily release the lock
                 release_lock(self.lock)
@@ -334,6 +335,24 @@ class EditorApp:
         self._close_current_file()
         self._set_status("Ready")
 
+    def _run_background(self, target, *args):
+        """Queue target on the task pool; returns the future, or None if the pool is saturated"""
+        try:
+            return self.tasks.try_submit(target, *args)
+        except TaskPoolFull:
+            self._set_status(f"Busy ({self.tasks.queue_depth} tasks waiting), try again")
+            return None
+
+    def _start_thread(self, thread):
+        """Start a CustomThread without blocking the UI; returns False if the pool is saturated"""
+        try:
+            thread.start()
+            return True
+        except TaskPoolFull:
+            self.progress.stop()
+            self._set_status(f"Busy ({self.tasks.queue_depth} tasks waiting), try again")
+            return False
+
     def _set_status(self, text):
         self.root.after(0, lambda: self.status.config(text=text))
 
@@ -392,11 +411,15 @@ class EditorApp:
         self._set_status(f"Loading {os.path.basename(cloud_path)}...")
         self.progress.start()
         
-        CustomThread(target=self._load_cloud_file, args=(cloud_path,), on_finish=self._on_cloud_file_loaded).start()
+        self._start_thread(CustomThread(target=self._load_cloud_file, args=(cloud_path,), on_finish=self._on_cloud_file_loaded, pool=self.tasks))
 
     def _load_cloud_file(self, cloud_path):
         """Background thread to load cloud file"""
         try:
+            # Other clients can't save this file while we hold its edit lease
+            if self.edit_mode:
+                self.cloud_lock = self.firebase.lock_file(self.user, cloud_path)
+
             # get_file expects the full cloud_path, not just filename
             # cloud_path is like "documents/gagaga.txt"
             cached_path = self.firebase.get_file(self.user, cloud_path)
@@ -408,6 +431,7 @@ class EditorApp:
             
             return {'success': True, 'path': cached_path}
         except Exception as e:
+            self._release_cloud_lock()
             return {'success': False, 'error': str(e)}
     
     def _on_cloud_file_loaded(self, result):
@@ -435,7 +459,7 @@ class EditorApp:
         self._set_status(f"Uploading {filename}...")
         self.progress.start()
         
-        CustomThread(target=self._upload_file, args=(path,), on_finish=self._on_upload_complete).start()
+        self._start_thread(CustomThread(target=self._upload_file, args=(path,), on_finish=self._on_upload_complete, pool=self.tasks))
 
     def _upload_file(self, local_path):
         """Background thread to upload file"""
@@ -494,7 +518,7 @@ class EditorApp:
         self._set_status(f"Deleting {os.path.basename(cloud_path)}...")
         self.progress.start()
         
-        CustomThread(target=self._delete_file, args=(cloud_path,), on_finish=self._on_delete_complete).start()
+        self._start_thread(CustomThread(target=self._delete_file, args=(cloud_path,), on_finish=self._on_delete_complete, pool=self.tasks))
 
     def _delete_file(self, cloud_path):
         """Background thread to delete cloud file"""
@@ -502,7 +526,8 @@ class EditorApp:
             filename = os.path.basename(cloud_path)
             # delete_owned_file signature: delete_owned_file(user, cloud_path)
             # cloud_path should be the full path like "documents/filename.txt"
-            self.firebase.delete_owned_file(self.user, cloud_path)
+            if not self.firebase.delete_owned_file(self.user, cloud_path):
+                return {'success': False, 'error': f"{filename} is not owned by this account"}
             return {'success': True, 'filename': filename}
         except Exception as e:
             return {'success': False, 'error': str(e)}
@@ -1,7 +1,14 @@
 import os
+import mmap
 import tempfile
+import threading
 import sys
 import subprocess
+from contextlib import contextmanager
+from typing import Callable, Iterable
+
+#Serializes seek+read/write pairs on platforms without os.pread/os.pwrite
+_seek_lock = threading.Lock()
 
 def set_windows_permissions(path):
     if sys.platform == 'win32':
@@ -20,6 +27,64 @@ def set_windows_permissions(path):
         except Exception as e:
             print(f"Permission setting error for {path}: {str(e)}")
 
+def open_binary(path: str, flags: int) -> int:
+    """Opens a raw descriptor for positioned I/O, in binary mode on Windows."""
+    return os.open(path, flags | getattr(os, 'O_BINARY', 0), 0o644)
+
+def pwrite(fd: int, data: bytes, offset: int):
+    """Writes all of data at offset without moving a shared file position."""
+    view = memoryview(data)
+    while view:
+        if hasattr(os, 'pwrite'):
+            written = os.pwrite(fd, view, offset)
+        else:
+            with _seek_lock:
+                os.lseek(fd, offset, os.SEEK_SET)
+                written = os.write(fd, view)
+        view = view[written:]
+        offset += written
+
+def pread(fd: int, size: int, offset: int) -> bytes:
+    """Reads size bytes at offset, fewer only at end of file, without moving a shared file position."""
+    chunks = []
+    while size > 0:
+        if hasattr(os, 'pread'):
+            data = os.pread(fd, size, offset)
+        else:
+            with _seek_lock:
+                os.lseek(fd, offset, os.SEEK_SET)
+                data = os.read(fd, size)
+        if not data:
+            break
+        chunks.append(data)
+        size -= len(data)
+        offset += len(data)
+    return b''.join(chunks)
+
+class FileView:
+    """Byte slices of an open file, read with pread, for code written against a bytes-like view.
+
+    Unlike slicing an mmap, reading past a file that another program truncated raises EOFError
+    instead of killing the process with SIGBUS.
+    """
+    def __init__(self, fd: int, size: int):
+        self.fd = fd
+        self.size = size
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __getitem__(self, index: slice) -> bytes:
+        if not isinstance(index, slice):
+            raise TypeError("FileView only supports slices")
+        start, stop, _ = index.indices(self.size)
+        if stop <= start:
+            return b''
+        data = pread(self.fd, stop - start, start)
+        if len(data) != stop - start:
+            raise EOFError(f"File shrank to {start + len(data)} bytes while it was being read")
+        return data
+
 def ensure_parent_dir(path):
     parent = os.path.dirname(path)
     if parent and not os.path.exists(parent):
@@ -30,7 +95,8 @@ def ensure_parent_dir(path):
         except Exception:
             pass  # Best effort
 
-def safe_write(path: str, data: str | bytes, encoding='utf-8'):
+def _prepare_write_target(path: str) -> str:
+    """Makes sure path can be replaced; returns its directory."""
     ensure_parent_dir(path)
     
     # Ensure the directory is writable
@@ -53,45 +119,137 @@ def safe_write(path: str, data: str | bytes, encoding='utf-8'):
     set_windows_permissions(path)
     if not os.access(path, os.W_OK):
         raise PermissionError(f"Cannot set write permissions on {path}")
-    
-    # Write to temp file in same directory then atomic replace
-    try:
-        fd, tmp_path = tempfile.mkstemp(dir=dirpath, prefix='.tmp-')
+    return dirpath
+
+def _fsync_dir(dirpath: str):
+    # Persists the rename itself; directories can't be opened for this on Windows
+    if hasattr(os, 'O_DIRECTORY'):
+        fd = os.open(dirpath, os.O_RDONLY | os.O_DIRECTORY)
         try:
-            mode = 'wb' if isinstance(data, (bytes, bytearray)) else 'w'
-            with os.fdopen(fd, mode, encoding=None if mode == 'wb' else encoding) as f:
-                f.write(data)
-            # Set permissions on temp file before replacing
-            os.chmod(tmp_path, 0o644)
-            os.replace(tmp_path, path)
-        except Exception as e:
-            raise IOError(f"Error writing to {path}: {e}")
+            os.fsync(fd)
         finally:
-            if os.path.exists(tmp_path):
-                try:
-                    os.remove(tmp_path)
-                except Exception:
-                    pass
+            os.close(fd)
+
+def _atomic_write(path: str, dirpath: str, write: Callable, fsync: bool):
+    """Calls write(f) on a binary temp file in the same directory, then atomically replaces path with it."""
+    try:
+        fd, tmp_path = tempfile.mkstemp(dir=dirpath, prefix='.tmp-')
     except Exception as e:
         raise IOError(f"Cannot create temporary file in {dirpath}: {e}")
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            written = write(f)
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        # Set permissions on temp file before replacing
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+        if fsync:
+            _fsync_dir(dirpath)
+        return written
+    except Exception as e:
+        raise IOError(f"Error writing to {path}: {e}") from e
+    finally:
+        if os.path.exists(tmp_path):
+            try:
+                os.remove(tmp_path)
+            except Exception:
+                pass
+
+def safe_write(path: str, data: str | bytes, encoding='utf-8', fsync: bool = False):
+    """Atomically replaces path with data; fsync=True also flushes it to disk before returning."""
+    dirpath = _prepare_write_target(path)
+    if isinstance(data, str):
+        # Same newline translation as a text-mode write
+        data = (data.replace('\n', os.linesep) if os.linesep != '\n' else data).encode(encoding)
+    payload = data
+    _atomic_write(path, dirpath, lambda f: f.write(payload), fsync)
+
+def safe_write_stream(path: str, chunks: Iterable, fsync: bool = False) -> int:
+    """Atomically replaces path with the concatenated buffers from chunks, never holding more than one in memory.
+
+    Returns the number of bytes written.
+    """
+    dirpath = _prepare_write_target(path)
+
+    def write(f):
+        written = 0
+        for chunk in chunks:
+            written += f.write(chunk)
+        return written
+
+    return _atomic_write(path, dirpath, write, fsync)
+
+def _check_readable(path: str):
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"File not found: {path}")
+    # Check and fix directory permissions
+    dirpath = os.path.dirname(path) or '.'
+    if not os.access(dirpath, os.R_OK):
+        set_windows_permissions(dirpath)
+        if not os.access(dirpath, os.R_OK):
+            raise PermissionError(f"Cannot access directory {dirpath}")
+    # Check and fix file permissions
+    if not os.access(path, os.R_OK):
+        set_windows_permissions(path)
+        if not os.access(path, os.R_OK):
+            raise PermissionError(f"Cannot access file {path}")
+
+def safe_read_bytes(path: str) -> bytes:
+    """Whole file as bytes, without decoding."""
+    _check_readable(path)
+    with open(path, 'rb') as f:
+        return f.read()
+
+def read_into(path: str, buffer, offset: int = 0) -> int:
+    """Fills a preallocated writable buffer (bytearray, memoryview, ...) from the file starting at offset.
+
+    Returns the number of bytes read, less than len(buffer) only at the end of the file.
+    """
+    _check_readable(path)
+    view = memoryview(buffer).cast('B')
+    total = 0
+    with open(path, 'rb', buffering=0) as f:
+        f.seek(offset)
+        while total < len(view):
+            count = f.readinto(view[total:])
+            if not count:
+                break
+            total += count
+    return total
+
+@contextmanager
+def mapped(path: str):
+    """Read-only memoryview over the file through mmap, so pages are loaded only as they are touched.
+
+    Use the view inside the with block and copy out (bytes(v[a:b])) anything needed after it. Slices
+    still alive when the block exits keep the mapping open until they are released.
+    """
+    _check_readable(path)
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            # mmap can't map an empty file
+            yield memoryview(b'')
+            return
+        m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(m)
+        try:
+            yield view
+        finally:
+            # Both raise BufferError while slices are exported; the mapping then closes with the last one
+            try:
+                view.release()
+                m.close()
+            except BufferError:
+                pass
 
 def safe_read(path: str, encoding='utf-8') -> str:
     if not os.path.exists(path):
         raise FileNotFoundError(f"File not found: {path}")
         
     try:
-        # Check and fix directory permissions
-        dirpath = os.path.dirname(path) or '.'
-        if not os.access(dirpath, os.R_OK):
-            set_windows_permissions(dirpath)
-            if not os.access(dirpath, os.R_OK):
-                raise PermissionError(f"Cannot access directory {dirpath}")
-        
-        # Check and fix file permissions
-        if not os.access(path, os.R_OK):
-            set_windows_permissions(path)
-            if not os.access(path, os.R_OK):
-                raise PermissionError(f"Cannot access file {path}")
+        _check_readable(path)
         
         # Try to read the file
         try:
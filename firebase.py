@@ -1,11 +1,19 @@
 import pyrebase
 from objects import User
 from datetime import datetime
-from scheduling import Computer, UploadProcess, DownloadProcess
+from scheduling import Computer, UploadProcess, CompositeUploadProcess, DeltaUploadProcess, SegmentedDownloadProcess
+from taskpool import TaskPool, TaskPoolFull, shared_pool
+from metacache import MetadataCache
+from cache import CacheManager
+from compression import should_compress, compress_file, decompress_file
+from cloudlock import CloudLease, CloudLockHeld
+from concurrent.futures import Future, Executor, ThreadPoolExecutor
 from typing import Callable
-from threading import Thread
-from time import sleep
-import json
+import threading
+import asyncio
+import time
+import hashlib
+import base64
 import os
 
 firebaseConfig = {
@@ -21,31 +29,117 @@ firebaseConfig = {
 }
 
 
-class CustomThread(Thread):
-    def __init__(self, target, args, on_finish:Callable):
-        super().__init__(target=target, args=args, daemon=True)
+class CustomThread:
+    """Runs target(*args) on the shared task pool and hands its result to on_finish.
+
+    start() never blocks its caller, usually the UI thread; it raises TaskPoolFull when the pool is saturated.
+    """
+
+    def __init__(self, target, args, on_finish:Callable, pool:TaskPool=None):
         self.on_finish = on_finish
         self.target = target
         self.args = args
+        self.pool = pool if (pool) else shared_pool()
+        self.future:Future = None
+
+    def start(self) -> Future:
+        self.future = self.pool.try_submit(self.run)
+        return self.future
     
     def run(self):
         result = self.target(*self.args)
         self.on_finish(result)
 
 
+def settle(target:Future, source:Future):
+    """Copies the outcome of a finished source future onto target, unless target is already done."""
+    if (target.done()):
+        return
+    if (source.cancelled()):
+        target.cancel()
+    elif (source.exception()):
+        target.set_exception(source.exception())
+    else:
+        target.set_result(source.result())
+
+
+def chain(future:Future, callback:Callable) -> Future:
+    """Future for callback(result) once future completes; when callback returns a future, that one is followed.
+
+    Errors carry over, and cancelling the chained future cancels whichever future it is waiting on.
+    """
+    chained = Future()
+    waiting_on = [future]
+    chained.add_done_callback(lambda done: waiting_on[-1].cancel() if (done.cancelled()) else None)
+
+    def on_done(done:Future):
+        if (done.cancelled() or done.exception()):
+            settle(chained, done)
+            return
+        try:
+            result = callback(done.result())
+        except Exception as e:
+            if (not chained.done()):
+                chained.set_exception(e)
+            return
+        if (isinstance(result, Future)):
+            waiting_on.append(result)
+            result.add_done_callback(lambda inner: settle(chained, inner))
+        elif (not chained.done()):
+            chained.set_result(result)
+
+    future.add_done_callback(on_done)
+    return chained
+
+
+def resolved(value) -> Future:
+    future = Future()
+    future.set_result(value)
+    return future
+
+
+def follow(future:Future) -> Future:
+    """Future with the same outcome as future; cancelling it leaves future running for its other waiters."""
+    follower = Future()
+    future.add_done_callback(lambda done: settle(follower, done))
+    return follower
+
+
+def notify(future:Future, on_finish:Callable):
+    """Calls on_finish with the future's result, or None if it failed or was cancelled."""
+    future.add_done_callback(lambda done: on_finish(None if (done.cancelled() or done.exception()) else done.result()))
+
+
 class Firebase:
     fb = pyrebase.initialize_app(firebaseConfig)
     auth = fb.auth()
     db = fb.database()
     storage = fb.storage()
+    #Files at least this large are uploaded as parallel parts joined with a compose call
+    composite_upload_threshold:int = 134217728
+    #Set to upload only the changed blocks of updates at least this large. Off by default: the blocks are kept
+    #in the bucket next to the file for the next update, doubling its stored size
+    delta_upload_threshold:int = None
+    #Gzip uploads that compress well; the encoding is recorded in owned_files
+    compress_uploads:bool = True
 
-    def __init__(self, computer:Computer):
+    def __init__(self, computer:Computer, tasks:TaskPool=None, cache:CacheManager=None):
         self.computer = computer
+        #Bounded pool for the blocking setup steps of background operations
+        self.tasks = tasks if (tasks) else shared_pool()
+        self.metadata = MetadataCache(self.db)
+        self.cache = cache if (cache) else CacheManager()
+        #Edit leases this client holds, by (user id, cloud path)
+        self.leases:dict[tuple[str, str], CloudLease] = {}
+        #Downloads in flight and the metadata they fetch, by (user id, cloud path)
+        self.downloads:dict[tuple[str, str], tuple[Future, dict]] = {}
+        self.downloads_lock = threading.Lock()
 
     def login(self, email:str, password:str) -> User:
         result = self.auth.sign_in_with_email_and_password(email, password)
         user = User(email, password)
         user.setup_account(result)
+        self.resume_transfers(user)
         return user
     
     def register(self, user:User):
@@ -53,87 +147,376 @@ class Firebase:
         user.setup_account(result)
     
     def upload_file(self, user:User, cloud_path:str, file_path:str):
+        self.upload_async(user, cloud_path, file_path).result()
+
+    def upload_async(self, user:User, cloud_path:str, file_path:str, delta:bool=False) -> Future:
+        """Opens the upload session and queues the transfer; the future resolves once the metadata is written."""
         cloud_path = cloud_path.strip("/")
-        path = cloud_path.split("/")
-        file_name = path.pop()
-        upload_process = UploadProcess(firebaseConfig["storageBucket"], user, cloud_path, file_path)
-        self.computer.add_process(upload_process)
-        while (not upload_process.is_completed()):
-            print("Uploading...")
-            sleep(0.5)
+        process = self.prepare_upload(user, cloud_path, file_path, delta)
+        if (process is None):
+            return resolved(None)
+        return chain(self.computer.add_process(process), lambda process: self.mark_modified(user, cloud_path, process))
+
+    def prepare_upload(self, user:User, cloud_path:str, file_path:str, delta:bool=False) -> UploadProcess | CompositeUploadProcess | DeltaUploadProcess:
+        """Upload process for the file, or None when the stored object already has the same content."""
+        md5 = self.content_md5(file_path)
+        stored = self.metadata.get(user, cloud_path)
+        if (not isinstance(stored, dict)):
+            stored = {}
+        if (stored.get('md5') == md5):
+            #Re-saving identical bytes neither uploads nor bumps modified, so other clients fetch nothing
+            return None
+        lock = stored.get('lock')
+        lease = self.leases.get((user.localId, cloud_path))
+        if (isinstance(lock, dict) and lock.get('expires', 0) > time.time() and not (lease and lease.owner == lock.get('owner'))):
+            raise CloudLockHeld(f"{cloud_path} is being edited by {lock.get('holder', 'another client')}")
+        previous = None
+        if (delta):
+            previous = self.cache.signature(cloud_path, stored.get('md5'))
+            #Without a matching signature every block is cut by the Python gear hash first. That is paid once for a
+            #file this client never delta-uploaded; after a save from elsewhere a plain upload is cheaper
+            delta = previous is not None or not self.cache.has_signature(cloud_path)
+        return self.create_upload_process(user, cloud_path, file_path, md5, delta=delta, previous=previous)
+
+    def create_upload_process(self, user:User, cloud_path:str, file_path:str, md5:str=None, delta:bool=False, previous:list[list]=None) -> UploadProcess | CompositeUploadProcess | DeltaUploadProcess:
+        size = os.path.getsize(file_path)
+        context = {'action':'upload', 'cloud_path':cloud_path, 'md5':md5 if (md5) else self.content_md5(file_path), 'size':size, 'source':file_path, 'encoding':None}
+        if (delta and self.delta_upload_threshold is not None and size >= self.delta_upload_threshold):
+            #Blocks are matched on the raw bytes, so delta uploads are never compressed
+            process = DeltaUploadProcess(firebaseConfig["storageBucket"], user, cloud_path, file_path, session=self.computer.session, previous=previous)
+        else:
+            source = file_path
+            if (self.compress_uploads and should_compress(file_path)):
+                source, context['object_md5'] = compress_file(file_path, f"{os.environ.get('CACHE_PATH')}/staging")
+                context['encoding'] = 'gzip'
+            try:
+                if (os.path.getsize(source) >= self.composite_upload_threshold):
+                    process = CompositeUploadProcess(firebaseConfig["storageBucket"], user, cloud_path, source, session=self.computer.session)
+                else:
+                    process = UploadProcess(firebaseConfig["storageBucket"], user, cloud_path, source, session=self.computer.session)
+            except Exception:
+                if (source != file_path):
+                    os.remove(source)
+                raise
+            process.staged = source != file_path
+        process.context = context
+        return process
+
+    def mark_modified(self, user:User, cloud_path:str, process=None):
+        data = {'type':'file', 'modified':datetime.now().isoformat(), **self.content_meta(process)}
+        self.db.child('users').child(user.localId).child('owned_files').child(*tuple(cloud_path.replace(".", "&123").split("/"))).update(data, token=user.idToken)
+        self.record_upload(user, cloud_path, data, process)
+
+    def record_upload(self, user:User, cloud_path:str, data:dict, process=None):
+        """Local bookkeeping once data is written to the file's owned_files node."""
+        self.metadata.update(user, cloud_path, data)
+        if (process is not None and os.path.abspath(process.context.get('source', process.file)) == os.path.abspath(self.cache.path(cloud_path))):
+            #Saved from its own cached copy, which now is the stored content
+            try:
+                self.cache.admit(cloud_path, data)
+            except Exception:
+                #Edited again since the upload read it; the next get downloads the stored version
+                pass
+        if (isinstance(process, DeltaUploadProcess)):
+            #The next update reuses every block of this version
+            self.cache.store_signature(cloud_path, data['md5'], process.signatures())
+
+    @staticmethod
+    def content_meta(process) -> dict:
+        """Hash, size, generation and encoding of an uploaded object, as stored next to its modified time.
+
+        md5 and size describe the file's own bytes, before any compression.
+        """
+        if (process is None or not process.context):
+            return {}
+        md5 = process.context.get('md5')
+        uploaded = process.object if (process.object) else {}
+        #Composed objects carry no md5Hash; single uploads are checked against the bytes that were sent
+        expected = process.context.get('object_md5', md5)
+        if (expected and uploaded.get('md5Hash') and uploaded['md5Hash'] != expected):
+            raise Exception(f"Uploaded content of {process.file_name} does not match the local file")
+        meta = {'md5':md5} if (md5) else {}
+        size = process.context.get('size', uploaded.get('size'))
+        if (size is not None):
+            meta['size'] = int(size)
+        if (uploaded.get('generation')):
+            meta['generation'] = uploaded['generation']
+        if ('encoding' in process.context):
+            #None clears the encoding of a previously compressed version
+            meta['encoding'] = process.context['encoding']
+        return meta
 
-        data = {file_name.replace(".", "&123"):{'type':'file', 'modified':datetime.now().isoformat()}}
-        self.db.child('users').child(user.localId).child('owned_files').child(*tuple(path)).update(data, token=user.idToken)
+    @staticmethod
+    def content_md5(file_path:str) -> str:
+        """Base64 MD5 of the file, in the form GCS reports as md5Hash."""
+        md5 = hashlib.md5()
+        with open(file_path, 'rb') as f:
+            while (block := f.read(1048576)):
+                md5.update(block)
+        return base64.b64encode(md5.digest()).decode()
+
+    def resume_transfers(self, user:User) -> list[Future]:
+        """Re-enqueues transfers journaled before a restart and finishes their metadata once they complete."""
+        futures = []
+        for process in self.computer.resume_transfers(user):
+            future = chain(process.future, lambda process: self.finish_resumed(user, process))
+            if (process.context and process.context.get('action') == 'download'):
+                #Gets of the file follow the resumed download like any other in flight
+                key = (user.localId, process.context['cloud_path'])
+                download = Future()
+                with self.downloads_lock:
+                    self.downloads.setdefault(key, (download, process.context['meta']))
+                future.add_done_callback(lambda done, key=key, download=download: self.finish_download(key, download, done))
+            futures.append(future)
+        return futures
+
+    def finish_resumed(self, user:User, process):
+        if (not process.context):
+            return
+        if (process.context.get('action') == 'upload'):
+            self.mark_modified(user, process.context['cloud_path'], process)
+        elif (process.context.get('action') == 'download'):
+            self.store_download(process.context['cloud_path'], process.context['meta'], process.etag)
+
+    def lock_file(self, user:User, cloud_path:str, timeout:float=0) -> CloudLease:
+        """Takes the edit lease on a cloud file; uploads from other clients are refused while it is held."""
+        cloud_path = cloud_path.strip("/")
+        lease = CloudLease(firebaseConfig["databaseURL"], user, cloud_path, session=self.computer.session).acquire(timeout)
+        self.leases[(user.localId, cloud_path)] = lease
+        return lease
+
+    def unlock_file(self, user:User, cloud_path:str):
+        lease = self.leases.pop((user.localId, cloud_path.strip("/")), None)
+        if (lease):
+            lease.release()
 
     def get_owned_files(self, user:User) -> dict:
-        files = self.db.child('users').child(user.localId).child('owned_files').get(token=user.idToken).val()
-        return files if (files) else {}
+        return self.metadata.tree(user)
     
-    def file_is_owned(self, user:User, file_name:str, d:dict) -> bool:
-        found = False
-        for key in d.keys():
-            if 'type' not in d.get(key):
-                print(d.get(key))
-                found = self.file_is_owned(user, file_name, d.get(key))
-            if key == file_name:
-                return True
-        return found
+    def file_is_owned(self, user:User, cloud_path:str) -> bool:
+        """Looks the full path up in the metadata cache, so only the nodes along it are visited."""
+        node = self.metadata.get(user, cloud_path)
+        return isinstance(node, dict) and 'type' in node
 
     def get_access_list_ids(self, user:User) -> list[str]:
         files = self.db.child('users').child(user.localId).child('access_list').get(token=user.idToken).val()
         return files if (files) else []
 
     def update_file(self, user:User, cloud_path:str, file_path:str):
+        self.upload_async(user, cloud_path, file_path, delta=True).result()
+
+    def delete_owned_file(self, user:User, cloud_path:str) -> bool:
         cloud_path = cloud_path.strip("/")
-        process = UploadProcess(firebaseConfig["storageBucket"], user, cloud_path, file_path)
-        self.computer.add_process(process)
-        while (not process.is_completed()):
-            print("Uploading...")
-            sleep(0.5)
-        self.db.child('users').child(user.localId).child('owned_files').child(*tuple(cloud_path.replace(".", "&123").split("/"))).update({'modified':datetime.now().isoformat()}, token=user.idToken)
-
-    def delete_owned_file(self, user:User, cloud_path:str):
-        cloud_path = cloud_path.strip("/")
-        if (not self.file_is_owned(user, cloud_path.split("/")[-1], self.get_owned_file_ids(user).get('users'))):
-            print("File is not owned by the user. Can't delete it")
-            return
-        self.storage.delete(f'files/{user.localId}/{cloud_path}', user.idToken)
+        if (not self.file_is_owned(user, cloud_path)):
+            return False
+        self.delete_stored(user, cloud_path)
         self.db.child('users').child(user.localId).child('owned_files').child(*tuple(cloud_path.replace(".", "&123").split("/"))).set(None, token=user.idToken)
-        print("File is deleted")
+        self.metadata.remove(user, cloud_path)
+        self.cache.remove(cloud_path)
+        return True
 
+    def delete_stored(self, user:User, cloud_path:str):
+        """Deletes the file's object and any blocks kept for delta uploads."""
+        self.storage.delete(f'files/{user.localId}/{cloud_path}', user.idToken)
+        DeltaUploadProcess.delete_blocks(self.computer.session, firebaseConfig["storageBucket"], user, cloud_path)
 
     def get_file(self, user:User, cloud_path:str) -> str:
+        return self.get_async(user, cloud_path).result()
+
+    def get_async(self, user:User, cloud_path:str) -> Future:
+        """Looks up the file and queues a download if the cache is stale; the future resolves with the cached path.
+
+        Gets of a path already being downloaded follow that download instead of rewriting the same cache file.
+        """
         cloud_path = cloud_path.strip("/")
-        file = self.db.child('users').child(user.localId).child('owned_files').child(*tuple(cloud_path.replace(".", "&123").split("/"))).get(token=user.idToken).val()
+        file = self.metadata.get(user, cloud_path)
         if (not file):
-            return None
-        
+            return resolved(None)
+
+        key = (user.localId, cloud_path)
+        with self.downloads_lock:
+            in_flight = self.downloads.get(key)
+            if (in_flight is None):
+                download = Future()
+                self.downloads[key] = (download, file)
+        if (in_flight is not None):
+            future, meta = in_flight
+            if (CacheManager.matches(meta, file)):
+                return follow(future)
+            #A newer version than the one being fetched; get it once that download is done with the file
+            return chain(future, lambda path: self.get_async(user, cloud_path))
+
         try:
-            with open(f"{os.environ.get("CACHE_PATH")}/meta/{cloud_path.replace(".", "&123")}.json", 'r') as f:
-                cache_meta:dict = json.loads(f.read())
-        except FileNotFoundError:
-            cache_meta = {}
-        
-        if (cache_meta.get("modified") != file.get('modified', '')):
-            print('file is outdated')
-            url = self.storage.child(f'files/{user.localId}/{cloud_path}').get_url(user.idToken)
-            process = DownloadProcess(url, user, cloud_path)
-            self.computer.add_process(process)
-            while (not process.is_completed()):
-                sleep(0.5)
-            try:
-                with open(f"{os.environ.get("CACHE_PATH")}/meta/{cloud_path.replace(".", "&123")}.json", 'w') as f:
-                    f.write(json.dumps(file))
-            except FileNotFoundError:
-                os.makedirs(f"{os.environ.get('CACHE_PATH')}/meta/{'/'.join(cloud_path.split('/')[:-1])}", exist_ok=True)
-                with open(f"{os.environ.get('CACHE_PATH')}/meta/{cloud_path.replace('.', '&123')}.json", 'w') as f:
-                    f.write(json.dumps(file))
-        return f"{os.environ.get("CACHE_PATH")}/{cloud_path}"
-
-    def upload_thread(self, user:User, cloud_path:str, file_path:str, on_finish:Callable):
-        CustomThread(self.upload_file, args=(user, cloud_path, file_path), on_finish=on_finish).start()
+            result = self.download(user, cloud_path, file)
+        except Exception as e:
+            result = Future()
+            result.set_exception(e)
+        result.add_done_callback(lambda done: self.finish_download(key, download, done))
+        return result
+
+    def download(self, user:User, cloud_path:str, file:dict) -> Future:
+        cached_path = self.cache.lookup(cloud_path, file)
+        if (cached_path):
+            return resolved(cached_path)
+
+        url = self.storage.child(f'files/{user.localId}/{cloud_path}').get_url(user.idToken)
+        #The cached ETag turns an unchanged object into a 304 on the first request instead of a download
+        process = SegmentedDownloadProcess(url, user, cloud_path, session=self.computer.session, etag=self.cache.etag(cloud_path))
+        if (process.not_modified):
+            process.close()
+            return resolved(self.cache.refresh(cloud_path, file))
+        process.context = {'action':'download', 'cloud_path':cloud_path, 'meta':file}
+        return chain(self.computer.add_process(process), lambda process: self.store_download(cloud_path, file, process.etag))
+
+    def finish_download(self, key:tuple[str, str], download:Future, done:Future):
+        with self.downloads_lock:
+            if (self.downloads.get(key, (None,))[0] is download):
+                del self.downloads[key]
+        settle(download, done)
+
+    def store_download(self, cloud_path:str, file:dict, etag:str=None) -> str:
+        """Decodes a finished download in place and admits it to the cache."""
+        if (file.get('encoding') == 'gzip'):
+            decompress_file(self.cache.path(cloud_path))
+        return self.cache.admit(cloud_path, file, etag)
+
+    def upload_thread(self, user:User, cloud_path:str, file_path:str, on_finish:Callable) -> Future:
+        future = chain(self.tasks.submit(self.upload_async, user, cloud_path, file_path), lambda transfer: transfer)
+        notify(future, on_finish)
+        return future
     
-    def get_thread(self, user:User, cloud_path:str, on_finish:Callable):
-        CustomThread(self.get_file, args=(user, cloud_path), on_finish=on_finish).start()
+    def get_thread(self, user:User, cloud_path:str, on_finish:Callable) -> Future:
+        future = chain(self.tasks.submit(self.get_async, user, cloud_path), lambda transfer: transfer)
+        notify(future, on_finish)
+        return future
+
+
+    def upload_files(self, user:User, files:list[tuple[str, str]]) -> dict[str, object]:
+        """Uploads many (cloud_path, file_path) pairs together and records them all in one multi-path update.
+
+        Returns each cloud path mapped to True, or to the exception that stopped it.
+        """
+        transfers = {}
+        for cloud_path, file_path in files:
+            cloud_path = cloud_path.strip("/")
+            transfers[cloud_path] = chain(self.background(self.prepare_upload, user, cloud_path, file_path), lambda process: self.computer.add_process(process) if (process) else resolved(None))
+        results = {}
+        uploaded = {}
+        processes = {}
+        modified = datetime.now().isoformat()
+        for cloud_path, result in self.collect(transfers).items():
+            results[cloud_path] = result if (isinstance(result, Exception)) else True
+            if (result is None or isinstance(result, Exception)):
+                continue
+            try:
+                uploaded[cloud_path] = {'type':'file', 'modified':modified, **self.content_meta(result)}
+                processes[cloud_path] = result
+            except Exception as e:
+                results[cloud_path] = e
+
+        if (uploaded):
+            update = {f"{cloud_path.replace('.', '&123')}/{key}": value for cloud_path, data in uploaded.items() for key, value in data.items()}
+            try:
+                self.db.child('users').child(user.localId).child('owned_files').update(update, token=user.idToken)
+            except Exception as e:
+                return {**results, **{cloud_path: e for cloud_path in uploaded}}
+            for cloud_path, data in uploaded.items():
+                self.record_upload(user, cloud_path, data, processes[cloud_path])
+        return results
+
+    def get_files(self, user:User, cloud_paths:list[str]) -> dict[str, object]:
+        """Fetches many files at once; returns each cloud path mapped to its cached path, None, or an exception."""
+        downloads = {cloud_path.strip("/"): chain(self.background(self.get_async, user, cloud_path), lambda transfer: transfer) for cloud_path in cloud_paths}
+        return self.collect(downloads)
+
+    def delete_owned_files(self, user:User, cloud_paths:list[str]) -> dict[str, object]:
+        """Deletes many owned files and clears their metadata in one multi-path update.
+
+        Returns each cloud path mapped to True, False when the user does not own it, or an exception.
+        """
+        results = {}
+        deletes = {}
+        for cloud_path in cloud_paths:
+            cloud_path = cloud_path.strip("/")
+            if (not self.file_is_owned(user, cloud_path)):
+                results[cloud_path] = False
+                continue
+            deletes[cloud_path] = self.background(self.delete_stored, user, cloud_path)
+        for cloud_path, result in self.collect(deletes).items():
+            results[cloud_path] = result if (isinstance(result, Exception)) else True
+
+        deleted = [cloud_path for cloud_path, result in results.items() if (result is True)]
+        if (deleted):
+            try:
+                self.db.child('users').child(user.localId).child('owned_files').update({cloud_path.replace('.', '&123'): None for cloud_path in deleted}, token=user.idToken)
+            except Exception as e:
+                return {**results, **{cloud_path: e for cloud_path in deleted}}
+            for cloud_path in deleted:
+                self.metadata.remove(user, cloud_path)
+                self.cache.remove(cloud_path)
+        return results
+
+    def background(self, function:Callable, *args) -> Future:
+        """Runs function on the task pool, or right here when called from the pool or once it is full.
+
+        The batch operations queue one task per path and then wait for them. On a pool worker, those
+        tasks could sit behind the very workers waiting for them, so the caller does the work itself.
+        """
+        if (not self.tasks.in_worker()):
+            try:
+                return self.tasks.try_submit(function, *args)
+            except TaskPoolFull:
+                pass
+        future = Future()
+        try:
+            future.set_result(function(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    @staticmethod
+    def collect(futures:dict[str, Future]) -> dict[str, object]:
+        """Waits for every future; each key maps to its result, or to the exception it raised."""
+        results = {}
+        for key, future in futures.items():
+            try:
+                results[key] = future.result()
+            except Exception as e:
+                results[key] = e
+        return results
+
+class AsyncFirebase:
+    """asyncio front end for Firebase.
+
+    Transfers are awaited through the Computer's futures, so a pending upload or download holds no
+    thread. Only the short blocking database and session-setup calls run on an executor, a plain one
+    by default: run_in_executor submits from the event loop, which must never wait on a full TaskPool.
+    """
+
+    def __init__(self, firebase:Firebase, executor:Executor=None):
+        self.firebase = firebase
+        self.executor = executor if (executor) else ThreadPoolExecutor(max_workers=8, thread_name_prefix="firebase")
+
+    async def call(self, function:Callable, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, function, *args)
+
+    async def login(self, email:str, password:str) -> User:
+        return await self.call(self.firebase.login, email, password)
+
+    async def get_owned_files(self, user:User) -> dict:
+        return await self.call(self.firebase.get_owned_files, user)
+
+    async def get_file(self, user:User, cloud_path:str) -> str:
+        future = await self.call(self.firebase.get_async, user, cloud_path)
+        return await asyncio.wrap_future(future)
+
+    async def upload_file(self, user:User, cloud_path:str, file_path:str):
+        future = await self.call(self.firebase.upload_async, user, cloud_path, file_path)
+        return await asyncio.wrap_future(future)
 
+    async def update_file(self, user:User, cloud_path:str, file_path:str):
+        future = await self.call(self.firebase.upload_async, user, cloud_path, file_path, True)
+        return await asyncio.wrap_future(future)
 
+    async def delete_owned_file(self, user:User, cloud_path:str):
+        return await self.call(self.firebase.delete_owned_file, user, cloud_path)
@@ -0,0 +1,58 @@
+from urllib.parse import quote
+import tempfile
+import json
+import os
+
+
+class TransferJournal:
+    """On-disk record of in-flight transfers, one JSON file per transfer under CACHE_PATH/meta/journal."""
+
+    @staticmethod
+    def key(user_id:str, process_type:str, file_name:str) -> str:
+        return f"{user_id}:{process_type}:{file_name}"
+
+    def root(self) -> str:
+        return f'{os.environ.get("CACHE_PATH")}/meta/journal'
+
+    def entry_path(self, key:str) -> str:
+        return f"{self.root()}/{quote(key, safe='')}.json"
+
+    def record(self, key:str, entry:dict):
+        """Replaces the entry atomically; runs about once a second per transfer, so no permission repair as in safe_write."""
+        os.makedirs(self.root(), exist_ok=True)
+        fd, temporary = tempfile.mkstemp(dir=self.root(), prefix=".tmp-")
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(json.dumps(entry))
+            os.replace(temporary, self.entry_path(key))
+        except BaseException:
+            try:
+                os.remove(temporary)
+            except OSError:
+                pass
+            raise
+
+    def remove(self, key:str):
+        try:
+            os.remove(self.entry_path(key))
+        except FileNotFoundError:
+            pass
+
+    def entries(self, user_id:str) -> list[dict]:
+        """Every recorded transfer that belongs to the user; unreadable entries are skipped."""
+        try:
+            names = os.listdir(self.root())
+        except FileNotFoundError:
+            return []
+        entries = []
+        for name in names:
+            if (not name.endswith(".json")):
+                continue
+            try:
+                with open(f"{self.root()}/{name}", 'r') as f:
+                    entry = json.loads(f.read())
+            except (OSError, ValueError):
+                continue
+            if (entry.get("user") == user_id):
+                entries.append(entry)
+        return entries
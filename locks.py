@@ -1,7 +1,12 @@
 import os
+import sys
+import json
 import time
+import uuid
 import errno
+import socket
 import tempfile
+import threading
 from contextlib import contextmanager
 
 try:
@@ -11,6 +16,27 @@ except ImportError:
     portalocker = None
     _HAS_PORTALOCKER = False
 
+# Wakes waiters in this process when a lock file is removed; other processes are polled with backoff
+_lockfile_released = threading.Condition()
+_MIN_POLL = 0.002
+_MAX_POLL = 0.05
+
+# Lock files are leases: held ones are renewed in the background, expired ones can be taken over
+_LEASE_SECONDS = 30
+_leases = {}
+_leases_lock = threading.Lock()
+_renewer = None
+
+def _read_boot_id():
+    try:
+        with open('/proc/sys/kernel/random/boot_id') as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+_HOST = socket.gethostname()
+_BOOT_ID = _read_boot_id()
+
 def get_lock_path(file_path):
     """Get the path for the lock file"""
     lock_dir = os.path.join(tempfile.gettempdir(), 'cloudos_locks')
@@ -18,103 +44,416 @@ def get_lock_path(file_path):
     safe_name = os.path.abspath(file_path).replace(os.sep, '_')
     return os.path.join(lock_dir, f"{safe_name}.lock")
 
-class LockHandle:
-    def __init__(self, fh, exclusive: bool, path: str):
-        self._fh = fh
+class FileLock:
+    """The OS-level lock on one path: a portalocker handle, or a lock file when portalocker is missing."""
+    def __init__(self, fh, exclusive: bool, path: str, token: str = None):
+        self.fh = fh
         self.exclusive = exclusive
-        self._path = path
-        self._lockfile = get_lock_path(path) if not _HAS_PORTALOCKER and exclusive else None
+        self.path = path
+        self.lockfile = get_lock_path(path) if not _HAS_PORTALOCKER and exclusive else None
+        self.token = token
 
     def release(self):
         try:
-            if _HAS_PORTALOCKER and self._fh:
-                portalocker.unlock(self._fh)
-                self._fh.close()
-            elif self._lockfile and os.path.exists(self._lockfile):
-                os.remove(self._lockfile)
+            if _HAS_PORTALOCKER and self.fh:
+                try:
+                    portalocker.unlock(self.fh)
+                finally:
+                    self.fh.close()
+                    self.fh = None
+            elif self.lockfile:
+                # Under the renewer's lock, so a renewal can't put the file back after it is removed
+                with _leases_lock:
+                    _leases.pop(self.lockfile, None)
+                    # Only remove our own lease; it may have expired and been taken over
+                    info = _read_lease(self.lockfile)
+                    if info and info.get('token') == self.token:
+                        try:
+                            os.remove(self.lockfile)
+                        except FileNotFoundError:
+                            pass
+                self.lockfile = None
+                with _lockfile_released:
+                    _lockfile_released.notify_all()
         except Exception:
             pass
 
+class _PathLock:
+    """Reader/writer state of one path inside this process."""
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.readers = 0
+        self.writer = False
+        self.writers_waiting = 0
+        # Set while the first reader takes the OS lock for everyone
+        self.acquiring = False
+        self.file_lock = None
+        # Holders and waiters; the entry leaves the table when this drops to zero
+        self.users = 0
+
+class LockManager:
+    """Process-wide reader/writer locks by path, layered over one OS-level lock per path.
+
+    Threads reading the same path share a single OS shared lock, reference counted; a writer takes
+    the OS exclusive lock. Waiting writers block new readers, so a steady stream of readers can't
+    starve them.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.paths = {}
+
+    def entry(self, path):
+        with self.lock:
+            state = self.paths.get(path)
+            if state is None:
+                state = self.paths[path] = _PathLock()
+            state.users += 1
+            return state
+
+    def leave(self, path, state):
+        with self.lock:
+            state.users -= 1
+            if state.users == 0 and self.paths.get(path) is state:
+                del self.paths[path]
+
+    def acquire(self, path, exclusive, timeout):
+        key = os.path.abspath(path)
+        deadline = time.monotonic() + timeout
+        state = self.entry(key)
+        try:
+            if exclusive:
+                self.acquire_writer(state, path, deadline, timeout)
+            else:
+                self.acquire_reader(state, path, deadline, timeout)
+        except BaseException:
+            self.leave(key, state)
+            raise
+        return LockHandle(self, key, state, exclusive, path)
+
+    def acquire_writer(self, state, path, deadline, timeout):
+        with state.cond:
+            state.writers_waiting += 1
+            try:
+                if not state.cond.wait_for(lambda: not (state.writer or state.readers or state.acquiring), deadline - time.monotonic()):
+                    raise TimeoutError(f"Could not acquire lock on {path} after {timeout} seconds")
+            finally:
+                state.writers_waiting -= 1
+            state.writer = True
+        try:
+            state.file_lock = _acquire_file_lock(path, True, timeout, max(0, deadline - time.monotonic()))
+        except BaseException:
+            with state.cond:
+                state.writer = False
+                state.cond.notify_all()
+            raise
+
+    def acquire_reader(self, state, path, deadline, timeout):
+        with state.cond:
+            # Writer preference: queue behind any waiting writer
+            if not state.cond.wait_for(lambda: not (state.writer or state.writers_waiting or state.acquiring), deadline - time.monotonic()):
+                raise TimeoutError(f"Could not acquire shared lock on {path} after {timeout} seconds")
+            if state.readers:
+                state.readers += 1
+                return
+            state.acquiring = True
+        try:
+            file_lock = _acquire_file_lock(path, False, timeout, max(0, deadline - time.monotonic()))
+        except BaseException:
+            with state.cond:
+                state.acquiring = False
+                state.cond.notify_all()
+            raise
+        with state.cond:
+            state.file_lock = file_lock
+            state.readers = 1
+            state.acquiring = False
+            state.cond.notify_all()
+
+    def release(self, key, state, exclusive):
+        with state.cond:
+            if exclusive:
+                state.writer = False
+            else:
+                state.readers -= 1
+            if not state.writer and state.readers == 0 and state.file_lock:
+                state.file_lock.release()
+                state.file_lock = None
+            state.cond.notify_all()
+        self.leave(key, state)
+
+_manager = LockManager()
+
+class LockHandle:
+    """Token for one holder of a path lock; several shared tokens can stand for the same OS lock."""
+    def __init__(self, manager: LockManager, key: str, state: _PathLock, exclusive: bool, path: str):
+        self._manager = manager
+        self._key = key
+        self._state = state
+        self.exclusive = exclusive
+        self._path = path
+        self._released = False
+        self._release_lock = threading.Lock()
+
+    @property
+    def fh(self):
+        """Handle of the OS lock while it is held, or None with the lock-file fallback."""
+        file_lock = self._state.file_lock
+        return file_lock.fh if file_lock and not self._released else None
+
+    def release(self):
+        with self._release_lock:
+            if self._released:
+                return
+            self._released = True
+        self._manager.release(self._key, self._state, self.exclusive)
+
     def __enter__(self):
         return self
 
     def __exit__(self, exc_type, exc, tb):
         self.release()
 
-def acquire_exclusive_lock(path, timeout=10):
-    """Exclusive lock: no other readers/writers."""
-    start_time = time.time()
+def _ensure_file(path):
+    if not os.path.exists(path):
+        parent = os.path.dirname(os.path.abspath(path))
+        os.makedirs(parent, exist_ok=True)
+        with open(path, 'a'):
+            pass
 
-    while True:
+def _wait_for_os_lock(fh, flags, timeout):
+    """Blocks on the OS lock in a helper thread so the wait ends as soon as the holder releases.
+
+    Returns False once timeout passes. A helper that gets the lock after that releases it and
+    closes the handle itself, so the caller must not touch fh after a False return.
+    """
+    done = threading.Event()
+    guard = threading.Lock()
+    state = {'acquired': False, 'abandoned': False, 'error': None}
+
+    def wait():
         try:
-            if _HAS_PORTALOCKER:
-                # Create file if it doesn't exist
-                if not os.path.exists(path):
-                    parent = os.path.dirname(os.path.abspath(path))
-                    os.makedirs(parent, exist_ok=True)
-                    with open(path, 'a'):
-                        pass
-                
-                fh = open(path, 'r+b')  # Need read+write
-                portalocker.lock(fh, portalocker.LOCK_EX | portalocker.LOCK_NB)
-                return LockHandle(fh, exclusive=True, path=path)
-            else:
-                # Fallback: atomic lock file creation
-                lockfile = get_lock_path(path)
+            portalocker.lock(fh, flags)
+        except Exception as e:
+            with guard:
+                state['error'] = e
+                abandoned = state['abandoned']
+                done.set()
+            if abandoned:
+                fh.close()
+            return
+        with guard:
+            if not state['abandoned']:
+                state['acquired'] = True
+                done.set()
+                return
+        try:
+            portalocker.unlock(fh)
+        finally:
+            fh.close()
+
+    threading.Thread(target=wait, name="lock-wait", daemon=True).start()
+    done.wait(timeout)
+    with guard:
+        if state['acquired']:
+            return True
+        if state['error'] is not None:
+            fh.close()
+            raise state['error']
+        state['abandoned'] = True
+        return False
+
+def _acquire_os_lock(path, exclusive, timeout, wait):
+    _ensure_file(path)
+    # One handle per acquisition; closed on every path that doesn't return it
+    fh = open(path, 'r+b' if exclusive else 'rb')
+    flags = portalocker.LOCK_EX if exclusive else portalocker.LOCK_SH
+    try:
+        portalocker.lock(fh, flags | portalocker.LOCK_NB)
+        return FileLock(fh, exclusive=exclusive, path=path)
+    except portalocker.LockException:
+        pass
+    except BaseException:
+        fh.close()
+        raise
+    if _wait_for_os_lock(fh, flags, wait):
+        return FileLock(fh, exclusive=exclusive, path=path)
+    kind = "lock" if exclusive else "shared lock"
+    raise TimeoutError(f"Could not acquire {kind} on {path} after {timeout} seconds")
+
+def _lease_record(token):
+    return json.dumps({'pid': os.getpid(), 'host': _HOST, 'boot_id': _BOOT_ID, 'token': token,
+                       'expires': time.time() + _LEASE_SECONDS}).encode()
+
+def _read_lease(lockfile):
+    """Lease in a lock file: None once it is gone, {} while it can't be parsed."""
+    try:
+        with open(lockfile, 'rb') as f:
+            data = f.read()
+    except FileNotFoundError:
+        return None
+    try:
+        info = json.loads(data)
+    except ValueError:
+        return {}
+    # Lock files from before leases hold just the PID
+    if isinstance(info, int):
+        return {'pid': info}
+    return info if isinstance(info, dict) else {}
+
+def _pid_alive(pid):
+    if not pid:
+        return False
+    if sys.platform == 'win32':
+        # os.kill would terminate the process on Windows; rely on the lease there
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def _lease_is_stale(lockfile, info):
+    if not info:
+        # Still being written, or left half-written by a crash
+        try:
+            return time.time() - os.path.getmtime(lockfile) > _LEASE_SECONDS
+        except FileNotFoundError:
+            return False
+    if info.get('expires', float('inf')) < time.time():
+        return True
+    if info.get('host', _HOST) != _HOST:
+        return False
+    if info.get('boot_id') and _BOOT_ID and info['boot_id'] != _BOOT_ID:
+        return True
+    return not _pid_alive(info.get('pid'))
+
+def _reclaim(lockfile, info):
+    """Removes a stale lock file, putting it back if another acquirer replaced it in the meantime."""
+    tomb = f"{lockfile}.{uuid.uuid4().hex}.stale"
+    try:
+        os.rename(lockfile, tomb)
+    except FileNotFoundError:
+        return
+    try:
+        if _read_lease(tomb) != info:
+            try:
+                os.link(tomb, lockfile)
+            except OSError:
+                pass
+    finally:
+        os.remove(tomb)
+
+def _renew_leases():
+    global _renewer
+    while True:
+        time.sleep(_LEASE_SECONDS / 3)
+        with _leases_lock:
+            if not _leases:
+                _renewer = None
+                return
+            held = dict(_leases)
+        for lockfile, token in held.items():
+            renewal = f"{lockfile}.{token}.renew"
+            try:
+                with open(renewal, 'wb') as f:
+                    f.write(_lease_record(token))
+                # The holder may have released since the snapshot; release removes the file under this lock
+                with _leases_lock:
+                    info = _read_lease(lockfile)
+                    if _leases.get(lockfile) == token and info and info.get('token') == token:
+                        os.replace(renewal, lockfile)
+                        continue
+                os.remove(renewal)
+            except OSError:
+                try:
+                    os.remove(renewal)
+                except OSError:
+                    pass
+
+def _hold_lease(lockfile, token):
+    global _renewer
+    with _leases_lock:
+        _leases[lockfile] = token
+        if _renewer is None:
+            _renewer = threading.Thread(target=_renew_leases, name="lock-lease-renewer", daemon=True)
+            _renewer.start()
+
+def lock_holder(path):
+    """Lease of the lock file on path (pid, host, boot_id, expires), or None when it isn't locked."""
+    return _read_lease(get_lock_path(path))
+
+def _clear_stale(lockfile):
+    """True once no live lease holds lockfile, reclaiming a stale one."""
+    info = _read_lease(lockfile)
+    if info is None:
+        return True
+    if _lease_is_stale(lockfile, info):
+        _reclaim(lockfile, info)
+        return True
+    return False
+
+def _wait_for_lockfile(attempt, deadline):
+    """Calls attempt() until it succeeds, sleeping on the release condition between tries."""
+    delay = _MIN_POLL
+    while True:
+        with _lockfile_released:
+            result = attempt()
+            if result is not None:
+                return result
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            _lockfile_released.wait(min(delay, remaining))
+        delay = min(delay * 2, _MAX_POLL)
+
+def _acquire_file_lock(path, exclusive, timeout, wait):
+    """Takes the OS-level lock, giving up after wait seconds; timeout is only for the error message."""
+    kind = "lock" if exclusive else "shared lock"
+    try:
+        if _HAS_PORTALOCKER:
+            return _acquire_os_lock(path, exclusive, timeout, wait)
+
+        lockfile = get_lock_path(path)
+        if exclusive:
+            # Fallback: atomic lock file creation
+            def attempt():
+                token = uuid.uuid4().hex
                 try:
                     fd = os.open(lockfile, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
-                    os.write(fd, str(os.getpid()).encode())
-                    os.close(fd)
-                    return LockHandle(None, exclusive=True, path=path)
                 except OSError as e:
                     if e.errno == errno.EEXIST:
-                        if time.time() - start_time >= timeout:
-                            raise TimeoutError(f"Could not acquire lock on {path} after {timeout} seconds")
-                        time.sleep(0.1)
-                        continue
+                        # A crashed or expired holder doesn't block; try again right away
+                        return attempt() if _clear_stale(lockfile) else None
                     raise
-        except PermissionError as e:
-            raise PermissionError(f"Cannot access file {path}. Please check file permissions.") from e
-        except Exception as e:
-            if time.time() - start_time >= timeout:
-                raise TimeoutError(f"Could not acquire lock on {path} after {timeout} seconds")
-            time.sleep(0.1)
-            continue
+                try:
+                    os.write(fd, _lease_record(token))
+                finally:
+                    os.close(fd)
+                _hold_lease(lockfile, token)
+                return FileLock(None, exclusive=True, path=path, token=token)
+        else:
+            # Fallback: check for exclusive lock
+            def attempt():
+                if not _clear_stale(lockfile):
+                    return None
+                return FileLock(None, exclusive=False, path=path)
+
+        file_lock = _wait_for_lockfile(attempt, time.monotonic() + wait)
+        if file_lock is None:
+            raise TimeoutError(f"Could not acquire {kind} on {path} after {timeout} seconds")
+        return file_lock
+    except PermissionError as e:
+        raise PermissionError(f"Cannot access file {path}. Please check file permissions.") from e
+
+def acquire_exclusive_lock(path, timeout=10):
+    """Exclusive lock: no other readers/writers."""
+    return _manager.acquire(path, True, timeout)
 
 def acquire_shared_lock(path, timeout=10):
     """Shared lock: multiple readers allowed."""
-    start_time = time.time()
-
-    while True:
-        try:
-            if _HAS_PORTALOCKER:
-                # Create file if it doesn't exist
-                if not os.path.exists(path):
-                    parent = os.path.dirname(os.path.abspath(path))
-                    os.makedirs(parent, exist_ok=True)
-                    with open(path, 'a'):
-                        pass
-
-                fh = open(path, 'rb')
-                portalocker.lock(fh, portalocker.LOCK_SH | portalocker.LOCK_NB)
-                return LockHandle(fh, exclusive=False, path=path)
-            else:
-                # Fallback: check for exclusive lock
-                lockfile = get_lock_path(path)
-                if not os.path.exists(lockfile):
-                    # No exclusive lock, allow shared access
-                    return LockHandle(None, exclusive=False, path=path)
-                if time.time() - start_time >= timeout:
-                    raise TimeoutError(f"Could not acquire shared lock on {path} after {timeout} seconds")
-                time.sleep(0.1)
-                continue
-        except PermissionError as e:
-            raise PermissionError(f"Cannot access file {path}. Please check file permissions.") from e
-        except Exception as e:
-            if time.time() - start_time >= timeout:
-                raise TimeoutError(f"Could not acquire shared lock on {path} after {timeout} seconds")
-            time.sleep(0.1)
-            continue
+    return _manager.acquire(path, False, timeout)
 
 def release_lock(lockhandle: LockHandle):
-    lockhandle.release()
\ No newline at end of file
+    lockhandle.release()
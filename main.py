@@ -46,7 +46,10 @@ while True:
         action = input("Do you want read (r) or delete (d) the file: ")
         if (action == 'd'):
             print("Deleting file in", f"users/{user.localId}/owned_files/"+"/".join(cur_dir))
-            fb.delete_owned_file(user, keys[choice][0], "/".join(cur_dir))
+            if (fb.delete_owned_file(user, "/".join(cur_dir+[keys[choice][0]]))):
+                print("File is deleted")
+            else:
+                print("File is not owned by the user. Can't delete it")
         else:
             print(f'reading file {keys[choice][0]}')
             with open(fb.get_file(user, "/".join(cur_dir)+"/"+keys[choice][0]), 'r') as f:
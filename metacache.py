@@ -0,0 +1,209 @@
+from objects import User
+import threading
+import logging
+import copy
+import time
+
+
+class MetadataCache:
+    """In-memory copy of each user's owned_files tree.
+
+    The tree is fetched once per user and then kept current by the Realtime Database streaming API,
+    so listing files and looking up a file's metadata are local reads. Writes made by this client are
+    applied straight away instead of waiting for their stream event. While no stream can be opened
+    nothing is kept, and every read fetches what it needs.
+    """
+    logger = logging.getLogger("MetadataCache")
+    #Seconds to wait for a new stream's first event, which carries the whole tree
+    stream_timeout:float = 10
+    #Seconds before a stream is tried again after one failed; reads go to the database meanwhile
+    retry_interval:float = 60
+
+    def __init__(self, db):
+        self.db = db
+        self.lock = threading.Lock()
+        self.trees:dict[str, dict] = {}
+        self.streams:dict[str, object] = {}
+        #Set by a stream's first event; present while the stream is opening or open
+        self.ready:dict[str, threading.Event] = {}
+        self.retry_at:dict[str, float] = {}
+
+    def owned_files(self, user:User):
+        return self.db.child('users').child(user.localId).child('owned_files')
+
+    def tree(self, user:User) -> dict:
+        """A copy of the user's whole owned_files tree."""
+        tree = self.cached(user.localId)
+        if (tree is None):
+            tree = self.load(user)
+        if (tree is None):
+            files = self.owned_files(user).get(token=user.idToken).val()
+            return self.plain(files) if (files) else {}
+        with self.lock:
+            return copy.deepcopy(tree)
+
+    def get(self, user:User, cloud_path:str) -> dict:
+        """Metadata of one file, walking only the nodes on its path."""
+        tree = self.cached(user.localId)
+        if (tree is None):
+            tree = self.load(user)
+        if (tree is None):
+            #Without a stream only the file's own node is fetched, not the whole tree
+            return self.plain(self.owned_files(user).child(*self.keys(cloud_path)).get(token=user.idToken).val())
+        with self.lock:
+            node = self.trees.get(user.localId, tree)
+            for key in self.keys(cloud_path):
+                if (not isinstance(node, dict) or key not in node):
+                    return None
+                node = node[key]
+            return copy.deepcopy(node)
+
+    def cached(self, user_id:str) -> dict:
+        """The tree kept current by the user's stream, or None; a stream whose thread has ended is dropped."""
+        with self.lock:
+            tree = self.trees.get(user_id)
+            stream = self.streams.get(user_id)
+        thread = getattr(stream, "thread", None)
+        if (tree is not None and thread is not None and not thread.is_alive()):
+            self.logger.error(f"The owned_files stream of {user_id} stopped")
+            with self.lock:
+                self.retry_at[user_id] = time.monotonic() + self.retry_interval
+            self.invalidate(user_id)
+            return None
+        return tree
+
+    def load(self, user:User) -> dict:
+        """Opens a stream and returns the tree it keeps, or None when that fails.
+
+        pyrebase connects on the stream's own thread and never reports a failure, so a stream only counts
+        as open once its first event, which carries the whole tree, arrives. One with nothing to show
+        within stream_timeout is closed and not tried again for retry_interval.
+        """
+        user_id = user.localId
+        with self.lock:
+            ready = self.ready.get(user_id)
+            opening = ready is None and time.monotonic() >= self.retry_at.get(user_id, 0)
+            if (opening):
+                ready = self.ready[user_id] = threading.Event()
+                self.streams[user_id] = None
+        if (opening):
+            try:
+                stream = self.owned_files(user).stream(lambda message: self.handle(user_id, message), token=user.idToken)
+            except Exception as e:
+                self.logger.error(f"Could not stream owned_files for {user_id}: {e}")
+                stream = None
+            with self.lock:
+                current = self.ready.get(user_id) is ready
+                if (current):
+                    self.streams[user_id] = stream
+            if (stream is not None and not current):
+                #Invalidated while opening
+                self.close(stream)
+            if (stream is None):
+                ready.set()
+        if (ready is not None and ready.wait(self.stream_timeout)):
+            with self.lock:
+                tree = self.trees.get(user_id)
+            if (tree is not None):
+                return tree
+        if (opening):
+            #A copy nothing updates would hide other clients' uploads, deletes and leases
+            self.logger.error(f"No tree from the owned_files stream of {user_id}; reading from the database for {self.retry_interval}s")
+            with self.lock:
+                self.retry_at[user_id] = time.monotonic() + self.retry_interval
+            self.invalidate(user_id)
+        return None
+
+    def handle(self, user_id:str, message:dict):
+        event = message.get("event")
+        if (event == "put"):
+            self.set_node(user_id, self.keys(message["path"]), message["data"])
+            with self.lock:
+                ready = self.ready.get(user_id)
+            if (ready):
+                ready.set()
+        elif (event == "patch"):
+            for key, value in message["data"].items():
+                self.set_node(user_id, self.keys(message["path"]) + self.keys(key), value)
+        elif (event in ("cancel", "auth_revoked")):
+            #The stream stopped; the next read fetches the tree again and reopens it
+            self.invalidate(user_id)
+
+    def update(self, user:User, cloud_path:str, data:dict):
+        """Merges data into the file's node, like a database update on that path."""
+        keys = self.keys(cloud_path)
+        with self.lock:
+            node = self.trees.get(user.localId)
+            if (node is None):
+                return
+            for key in keys:
+                if (not isinstance(node.get(key), dict)):
+                    node[key] = {}
+                node = node[key]
+            for key, value in data.items():
+                #A None value deletes the key, as it does in the database
+                if (value is None):
+                    node.pop(key, None)
+                else:
+                    node[key] = copy.deepcopy(value)
+
+    def remove(self, user:User, cloud_path:str):
+        self.set_node(user.localId, self.keys(cloud_path), None)
+
+    def invalidate(self, user_id:str):
+        with self.lock:
+            self.trees.pop(user_id, None)
+            stream = self.streams.pop(user_id, None)
+            ready = self.ready.pop(user_id, None)
+        if (ready):
+            #Readers waiting for the stream's first event fetch the tree themselves
+            ready.set()
+        if (stream):
+            self.close(stream)
+
+    @staticmethod
+    def close(stream):
+        try:
+            stream.close()
+        except Exception:
+            pass
+
+    def set_node(self, user_id:str, keys:list[str], data):
+        with self.lock:
+            tree = self.trees.get(user_id)
+            if (not keys):
+                #The stream's first event puts the whole tree
+                if (user_id in self.streams):
+                    self.trees[user_id] = self.plain(data) if (data) else {}
+                return
+            if (tree is None):
+                return
+            node = tree
+            parents = []
+            for key in keys[:-1]:
+                if (not isinstance(node.get(key), dict)):
+                    if (data is None):
+                        return
+                    node[key] = {}
+                parents.append((node, key))
+                node = node[key]
+            if (data is None):
+                node.pop(keys[-1], None)
+                #The database drops parents left without children
+                for parent, key in reversed(parents):
+                    if (parent[key]):
+                        break
+                    del parent[key]
+            else:
+                node[keys[-1]] = self.plain(data)
+
+    @staticmethod
+    def keys(path:str) -> list[str]:
+        return [key.replace(".", "&123") for key in path.strip("/").split("/") if (key)]
+
+    @staticmethod
+    def plain(data):
+        """Nested dicts in place of the OrderedDicts and lists pyrebase can hand back."""
+        if (isinstance(data, dict)):
+            return {key: MetadataCache.plain(value) for key, value in data.items()}
+        return copy.deepcopy(data)
@@ -1,8 +1,19 @@
 from objects import User
+from transport import create_session, shared_session
+from fileops import open_binary, pwrite, FileView
+from journal import TransferJournal
+from delta import Block, blocks
+from concurrent.futures import ThreadPoolExecutor, Future
 import google.auth.transport.requests
 from google.oauth2 import service_account
+from collections import OrderedDict
 from datetime import datetime
+import threading
+import itertools
+import time
+import heapq
 import logging
+from urllib.parse import quote
 import requests
 import math
 import sys
@@ -13,9 +24,17 @@ class Process:
     burst_time:int = 0
     original_burst_time:int = 0
     sub_processed_time:int = 0
-    sub_wait_time:int = 0
+    enqueued_time:float = 0
+    queue_token:int = 0
     process_id:int = 0
     completed_time:float
+    error:Exception = None
+    cancelled:bool = False
+    #Caller data kept with the journal entry so post-completion work survives a restart
+    context:dict = None
+    journaled_time:float = 0
+    #Resolved with the process once it completes; set by Computer.add_process
+    future:Future = None
 
     def __init__(self, user:User, priority:int=3):
         self.user = user
@@ -25,13 +44,9 @@ class Process:
         Process.process_id += 1
 
     
-    def wait(self):
-        self.sub_wait_time += 1
-    
     def increase_priority(self):
         if (self.priority > 1):
             self.priority -= 1
-            self.sub_wait_time = 0
     
     def decrease_priority(self):
         if (self.priority < 3):
@@ -45,191 +60,1022 @@ class Process:
     def is_completed(self) -> bool:
         return False
 
+    def close(self):
+        """Releases anything held for the lifetime of the process; called once it completes, fails or is cancelled."""
+        pass
+
+    def journal_entry(self) -> dict:
+        """Resumable state for the transfer journal, or None for processes that can't be resumed."""
+        return None
+
+
+class TransferProcess(Process):
+    """Base for chunked transfers whose chunk size follows the measured time per chunk."""
+    chunk_size:int
+    min_chunk_size:int
+    max_chunk_size:int
+    chunk_multiple:int = 1
+    target_chunk_time:float = 0.5
+    chunks_done:int = 0
+    #Set when the source file is a temporary copy made for this upload, such as a compressed one
+    staged:bool = False
+
+    def adapt_chunk_size(self, elapsed:float, transferred:int, total:int):
+        """Doubles the chunk while one takes under half the target slice and halves it once one takes over twice."""
+        size = self.chunk_size
+        if (elapsed < self.target_chunk_time / 2):
+            size *= 2
+        elif (elapsed > self.target_chunk_time * 2):
+            size //= 2
+        size = min(max(size, self.min_chunk_size), self.max_chunk_size)
+        self.chunk_size = max(self.chunk_multiple, size - size % self.chunk_multiple)
+        self.estimate_burst(transferred, total)
+
+    def estimate_burst(self, transferred:int, total:int):
+        """Recomputes remaining and total ticks from the current chunk size so SRTF keeps comparing like with like."""
+        self.burst_time = math.ceil(max(0, total - transferred) / self.chunk_size)
+        self.original_burst_time = self.chunks_done + self.burst_time
+
+    def process(self):
+        self.chunks_done += 1
+        super().process()
+
+    def discard_staged(self):
+        """Deletes a staged source once the upload is done with it."""
+        if (self.staged):
+            try:
+                os.remove(self.file)
+            except FileNotFoundError:
+                pass
+
+    @staticmethod
+    def verify_source(entry:dict, stat:os.stat_result):
+        """Raises unless the source still has the size and mtime the journal entry was made from.
 
-class DownloadProcess(Process):
+        Resuming with the journaled offsets, lengths and md5 over different bytes would store a corrupt object.
+        """
+        if (entry.get("source_size") != stat.st_size or entry.get("mtime") != stat.st_mtime):
+            raise Exception(f"{entry.get('file')} changed since its upload was journaled")
+
+    def journal_key(self) -> str:
+        return TransferJournal.key(self.user.localId, self.process_type, self.file_name)
+
+    def journal_entry(self) -> dict:
+        return {"type":self.process_type, "user":self.user.localId, "file_name":self.file_name, "context":self.context}
+
+
+class DownloadProcess(TransferProcess):
     process_type:str = "download"
-    download_size:int = 1024
+    chunk_size:int = 65536
+    min_chunk_size:int = 16384
+    max_chunk_size:int = 16777216
     current_downloaded:int = 0
+    total_size:int = 0
+    etag:str = None
+    fd:int = None
     completed:bool = False
+    #Set when the object still has the ETag of the cached copy, so nothing is fetched
+    not_modified:bool = False
+    restored:bool = False
+    #Failed range requests in a row, other than refusals, before the download fails
+    max_failures:int = 5
+    failures:int = 0
 
-    def __init__(self, download_link:str, user:User, file_name:str):
+    def __init__(self, download_link:str, user:User, file_name:str, session:requests.Session=None, resume:dict=None, etag:str=None):
         super().__init__(user)
+        self.session = session if (session) else shared_session()
         self.download_link = download_link
         self.file_name = file_name
+        self.path = f'{os.environ.get("CACHE_PATH")}/{file_name}'
+        headers = {"Authorization": "Bearer "+self.user.idToken, "Range":f"bytes=0-0"}
+        if (etag and not resume):
+            headers["If-None-Match"] = etag
+        r = self.session.get(self.download_link, headers=headers)
+        if (r.status_code == 304):
+            self.not_modified = True
+            self.etag = etag
+            self.completed = True
+            self.completed_time = datetime.now().timestamp()
+            return
+        elif (r.ok):
+            self.total_size = int(r.headers.get("Content-Range").split("/")[1])
+            self.etag = r.headers.get("ETag")
+        elif (r.status_code == 416):
+            #Empty object, nothing to fetch
+            self.completed = True
+            self.completed_time = datetime.now().timestamp()
+        else:
+            raise Exception("Failed to start download")
+
+        #One descriptor for the whole download, written with positioned I/O; a resumed download keeps its bytes
+        flags = os.O_RDWR | os.O_CREAT | (0 if (resume) else os.O_TRUNC)
+        if (not resume):
+            #A fresh download gets a new file, so a cached blob still linked at this path stays intact
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
         try:
-            with open(f'{os.environ.get("CACHE_PATH")}/{file_name}', 'wb') as f:
-                f.write(b'')
+            self.fd = open_binary(self.path, flags)
         except FileNotFoundError:
             os.makedirs(f'{os.environ.get("CACHE_PATH")}/{"/".join(self.file_name.split("/")[:-1])}', exist_ok=True)
-            with open(f'{os.environ.get("CACHE_PATH")}/{file_name}', 'wb') as f:
-                f.write(b'')
-        r = requests.get(self.download_link, headers={"Authorization": "Bearer "+self.user.idToken, "Range":f"bytes=0-0"})
-        if (r.ok):
-            total = r.headers.get("Content-Range").split("/")[1]
-            self.burst_time = math.ceil(int(total) / self.download_size)
-            self.original_burst_time = math.ceil(int(total) / self.download_size)
+            self.fd = open_binary(self.path, flags)
+
+        #Only resume when the object is still the version the journal saw
+        self.restored = bool(resume) and resume.get("etag") == self.etag and resume.get("total") == self.total_size
+        if (self.restored):
+            self.restore(resume)
+        elif (resume):
+            os.ftruncate(self.fd, 0)
+        self.estimate_burst(self.current_downloaded, self.total_size)
+
+    @classmethod
+    def from_journal(cls, entry:dict, user:User, session:requests.Session=None):
+        process = cls(entry["download_link"], user, entry["file_name"], session=session, resume=entry)
+        process.context = entry.get("context")
+        return process
+
+    def restore(self, entry:dict):
+        self.current_downloaded = entry["current_downloaded"]
+
+    def journal_entry(self) -> dict:
+        entry = super().journal_entry()
+        entry.update({"download_link":self.download_link, "etag":self.etag, "total":self.total_size, "current_downloaded":self.current_downloaded})
+        return entry
+
+    def fetch(self, start:int, end:int) -> int:
+        """Downloads bytes start..end (inclusive) into the cache file at their offset; returns the next offset."""
+        r = self.session.get(self.download_link, headers={"Authorization": "Bearer "+self.user.idToken, "Range":f"bytes={start}-{end}"})
+        if (not r.ok):
+            #A refusal such as 401 or 404 won't change on retry; timeouts, rate limits and server errors might
+            self.failures += 1
+            if ((400 <= r.status_code < 500 and r.status_code not in (408, 429)) or self.failures > self.max_failures):
+                raise Exception(f"Failed to download {self.file_name}: {r.status_code}")
+            return start
+        self.failures = 0
+        pwrite(self.fd, r.content, start)
+        end, total = r.headers.get("Content-Range").split("-")[1].split("/")
+        self.total_size = int(total)
+        return int(end) + 1
 
     def process(self):
-        r = requests.get(self.download_link, headers={"Authorization": "Bearer "+self.user.idToken, "Range":f"bytes={self.current_downloaded}-{self.current_downloaded+self.download_size-1}"})
-        if (r.ok):
-            with open(f'{os.environ.get("CACHE_PATH")}/{self.file_name}', 'ab') as f:
-                f.write(r.content)
-            end, total = r.headers.get("Content-Range").split("-")[1].split("/")
-            self.current_downloaded = int(end) + 1
+        start = time.monotonic()
+        downloaded = self.fetch(self.current_downloaded, self.current_downloaded+self.chunk_size-1)
+        if (downloaded > self.current_downloaded):
+            self.current_downloaded = downloaded
             super().process()
-            if (self.current_downloaded >= int(total)):
+            self.adapt_chunk_size(time.monotonic() - start, self.current_downloaded, self.total_size)
+            if (self.current_downloaded >= self.total_size):
                 self.completed = True
                 self.completed_time = datetime.now().timestamp()
     
     def is_completed(self) -> bool:
         return self.completed
 
+    def close(self):
+        if (self.fd is not None):
+            os.close(self.fd)
+            self.fd = None
+
+
+class SegmentedDownloadProcess(DownloadProcess):
+    """Downloads K byte ranges of one file concurrently into a preallocated cache file.
+
+    Each tick advances every unfinished segment by one chunk. The segments go into the transfer
+    journal, so a restarted download fetches only the missing ranges.
+    """
+    process_type:str = "segmented download"
+    max_segments:int = 4
+    min_segment_size:int = 8388608
+    segments:list[list[int]]
+
+    def __init__(self, download_link:str, user:User, file_name:str, session:requests.Session=None, resume:dict=None, etag:str=None):
+        super().__init__(download_link, user, file_name, session=session, resume=resume, etag=etag)
+        if (self.not_modified):
+            self.segments = []
+        elif (not self.restored):
+            count = max(1, min(self.max_segments, math.ceil(self.total_size / self.min_segment_size)))
+            size = math.ceil(self.total_size / count) if (self.total_size) else 0
+            self.segments = [[start, min(start + size, self.total_size)] for start in range(0, self.total_size, size)] if (size) else []
+            os.ftruncate(self.fd, self.total_size)
+        self.current_downloaded = self.total_size - self.remaining()
+        self.estimate_burst(0, self.largest_remaining())
+        self.pool = ThreadPoolExecutor(max_workers=max(1, len(self.segments)), thread_name_prefix=f"download-{self.process_id}")
+
+    def restore(self, entry:dict):
+        self.segments = entry["segments"]
+
+    def journal_entry(self) -> dict:
+        entry = super().journal_entry()
+        entry["segments"] = self.segments
+        return entry
+
+    def remaining(self) -> int:
+        return sum(end - start for start, end in self.segments)
+
+    def largest_remaining(self) -> int:
+        return max((end - start for start, end in self.segments), default=0)
+
+    def process(self):
+        start = time.monotonic()
+        pending = [segment for segment in self.segments if (segment[0] < segment[1])]
+        offsets = self.pool.map(lambda segment: self.fetch(segment[0], min(segment[0] + self.chunk_size, segment[1]) - 1), pending)
+        for segment, offset in zip(pending, offsets):
+            segment[0] = min(offset, segment[1])
+        self.current_downloaded = self.total_size - self.remaining()
+        TransferProcess.process(self)
+        self.adapt_chunk_size(time.monotonic() - start, 0, self.largest_remaining())
+        if (self.current_downloaded >= self.total_size):
+            self.completed = True
+            self.completed_time = datetime.now().timestamp()
 
-class UploadProcess(Process):
+    def close(self):
+        self.pool.shutdown(wait=False)
+        super().close()
+
+
+class UploadProcess(TransferProcess):
     process_type:str = "upload"
-    upload_url:str
-    upload_size:int = 262144
+    upload_url:str = None
+    #GCS resumable uploads take every chunk but the last in multiples of 256 KiB
+    chunk_size:int = 262144
+    min_chunk_size:int = 262144
+    max_chunk_size:int = 33554432
+    chunk_multiple:int = 262144
     current_uploaded:int = 0
     completed:bool = False
+    #Object resource GCS returns when the upload finishes (md5Hash, size, generation)
+    object:dict = None
     creds = service_account.Credentials.from_service_account_file('./cloudos-12cdc-firebase-adminsdk-fbsvc-9b35e8b6ff.json', scopes=["https://www.googleapis.com/auth/devstorage.full_control"])
+    creds_lock = threading.Lock()
 
-    def __init__(self, firebase_bucket:str, user:User, file_name:str, file:str):
+    def __init__(self, firebase_bucket:str, user:User, file_name:str, file:str, session:requests.Session=None, offset:int=0, length:int=None, resume:dict=None):
         super().__init__(user)
+        self.session = session if (session) else shared_session()
         self.file_name = file_name
         self.firebase_bucket = firebase_bucket
         self.file = file
-        self.file_size = os.path.getsize(file)
-        self.burst_time = math.ceil(self.file_size / self.upload_size)
-        self.original_burst_time = math.ceil(self.file_size / self.upload_size)
-        self.creds.refresh(google.auth.transport.requests.Request())
-        self.access_token = self.creds.token
+        #The source stays open for the whole upload instead of being reopened per chunk
+        self.fh = open(file, 'rb')
+        stat = os.fstat(self.fh.fileno())
+        size = stat.st_size
+        self.mtime = stat.st_mtime
+        self.source_size = size
+        if (resume):
+            try:
+                self.verify_source(resume, stat)
+            except Exception:
+                self.fh.close()
+                raise
+        self.view = FileView(self.fh.fileno(), size)
+        #Only bytes offset..offset+length of the source go into this object
+        self.offset = offset
+        self.file_size = length if (length is not None) else size - offset
+
+        if (resume and resume.get("upload_url")):
+            self.upload_url = resume["upload_url"]
+            self.query_session()
+        if (not self.upload_url):
+            self.start_session()
+        self.estimate_burst(self.current_uploaded, self.file_size)
+
+    @classmethod
+    def from_journal(cls, entry:dict, user:User, session:requests.Session=None):
+        process = cls(entry["bucket"], user, entry["file_name"], entry["file"], session=session, offset=entry["offset"], length=entry["length"], resume=entry)
+        process.context = entry.get("context")
+        process.staged = entry.get("staged", False)
+        return process
+
+    def journal_entry(self) -> dict:
+        entry = super().journal_entry()
+        entry.update({"bucket":self.firebase_bucket, "file":self.file, "offset":self.offset, "length":self.file_size, "source_size":self.source_size, "mtime":self.mtime, "upload_url":self.upload_url, "current_uploaded":self.current_uploaded, "staged":self.staged})
+        return entry
 
-        url = f"https://storage.googleapis.com/upload/storage/v1/b/{self.firebase_bucket}/o?uploadType=resumable&name=files/{user.localId}/{self.file_name}"
+    def start_session(self):
+        url = f"https://storage.googleapis.com/upload/storage/v1/b/{self.firebase_bucket}/o?uploadType=resumable&name={self.object_name()}"
         headers = {
-            "Authorization": f"Bearer {self.access_token}",
+            "Authorization": self.authorization(self.session),
             "Content-Type": "application/json; charset=UTF-8",
             "X-Upload-Content-Type": "application/octet-stream",
         }
-        result = requests.post(url, headers=headers)
+        result = self.session.post(url, headers=headers)
         if (result.ok):
             self.upload_url = result.headers.get("Location")
+            self.current_uploaded = 0
         else:
+            self.close()
             raise Exception("Failed to initiate upload session")
 
+    def query_session(self):
+        """Asks GCS how much of a resumed session it has persisted; drops the session if it expired."""
+        headers = {
+            "Content-Range": f"bytes */{self.file_size}",
+            "Authorization": self.authorization(self.session)
+        }
+        result = self.session.put(self.upload_url, headers=headers)
+        if (result.ok):
+            self.object = self.response_object(result)
+            self.current_uploaded = self.file_size
+            self.completed = True
+            self.completed_time = datetime.now().timestamp()
+        elif (result.status_code == 308):
+            persisted = result.headers.get("Range")
+            self.current_uploaded = int(persisted.split("-")[1]) + 1 if (persisted) else 0
+        else:
+            self.upload_url = None
+
+    def object_name(self) -> str:
+        return f"files/{self.user.localId}/{self.file_name}"
+
+    @staticmethod
+    def response_object(result:requests.Response) -> dict:
+        try:
+            return result.json()
+        except ValueError:
+            return None
+
+    @classmethod
+    def compose(cls, session:requests.Session, firebase_bucket:str, sources:list[str], destination:str) -> dict:
+        """Joins up to 32 source objects, in order, into destination; returns the new object's resource."""
+        url = f"https://storage.googleapis.com/storage/v1/b/{firebase_bucket}/o/{quote(destination, safe='')}/compose"
+        body = {
+            "sourceObjects": [{"name": name} for name in sources],
+            "destination": {"contentType": "application/octet-stream"}
+        }
+        result = session.post(url, headers={"Authorization": cls.authorization(session)}, json=body)
+        if (not result.ok):
+            raise Exception(f"Failed to compose {destination}: {result.status_code}")
+        return cls.response_object(result)
+
+    @classmethod
+    def authorization(cls, session:requests.Session) -> str:
+        """Bearer header from the service account, refreshed only once the token has expired."""
+        with cls.creds_lock:
+            if (not cls.creds.valid):
+                cls.creds.refresh(google.auth.transport.requests.Request(session=session))
+            return f"Bearer {cls.creds.token}"
+
     def process(self):
         if (self.upload_url):
-            with open(self.file, 'rb') as f:
-                f.seek(self.current_uploaded)
-                chunk = f.read(self.upload_size)
-                if (not chunk):
+            start = self.offset + self.current_uploaded
+            chunk = self.view[start:start + min(self.chunk_size, self.file_size - self.current_uploaded)]
+            if (chunk):
+                content_range = f"bytes {self.current_uploaded}-{self.current_uploaded + len(chunk) - 1}/{self.file_size}"
+            else:
+                #Empty file: finalize the session without a body
+                content_range = f"bytes */{self.file_size}"
+            headers = {
+                "Content-Range": content_range,
+                "Authorization": self.authorization(self.session)
+            }
+
+            start = time.monotonic()
+            result = self.session.put(self.upload_url, headers=headers, data=chunk)
+            if (result.ok or result.status_code == 308):
+                #308 reports how much the server actually persisted
+                persisted = result.headers.get("Range")
+                self.current_uploaded = int(persisted.split("-")[1]) + 1 if (persisted) else self.current_uploaded + len(chunk)
+                if (result.ok):
+                    self.object = self.response_object(result)
+                    self.current_uploaded = self.file_size
+                super().process()
+                self.adapt_chunk_size(time.monotonic() - start, self.current_uploaded, self.file_size)
+                if (self.current_uploaded >= self.file_size):
                     self.completed = True
-                    return
-                headers = {
-                    "Content-Length": str(self.upload_size),
-                    "Content-Range": f"bytes {self.current_uploaded}-{self.current_uploaded + len(chunk) - 1}/{self.file_size}",
-                    "Authorization": f"Bearer {self.access_token}"
-                }
-
-                result = requests.put(self.upload_url, headers=headers, data=chunk)
-                if (result.ok or result.status_code == 308):
-                    self.current_uploaded += len(chunk)
-                    super().process()
-                    if (self.current_uploaded >= self.file_size):
-                        self.completed = True
-                        self.completed_time = datetime.now().timestamp()
+                    self.completed_time = datetime.now().timestamp()
                     
     def is_completed(self) -> bool:
         return self.completed
 
+    def close(self):
+        self.view = b''
+        self.fh.close()
+        self.discard_staged()
+
+
+class CompositeUploadProcess(TransferProcess):
+    """Uploads a large file as parallel part objects and joins them with a GCS compose call.
+
+    Each tick advances every unfinished part by one chunk. The part objects are deleted once the
+    compose succeeds, or when the process fails or is cancelled.
+    """
+    process_type:str = "composite upload"
+    #GCS composes at most 32 source objects per request
+    max_parts:int = 32
+    min_part_size:int = 33554432
+    current_uploaded:int = 0
+    completed:bool = False
+    object:dict = None
+
+    def __init__(self, firebase_bucket:str, user:User, file_name:str, file:str, session:requests.Session=None, parts:int=None, resume:dict=None):
+        super().__init__(user)
+        self.session = session if (session) else shared_session()
+        self.firebase_bucket = firebase_bucket
+        self.file_name = file_name
+        self.file = file
+        stat = os.stat(file)
+        if (resume):
+            self.verify_source(resume, stat)
+        self.file_size = stat.st_size
+        self.mtime = stat.st_mtime
+        count = parts if (parts) else math.ceil(self.file_size / self.min_part_size)
+        count = max(1, min(self.max_parts, count))
+        #Part boundaries on 256 KiB multiples so every part chunk stays valid for resumable uploads
+        size = max(1, math.ceil(self.file_size / count / UploadProcess.chunk_multiple)) * UploadProcess.chunk_multiple
+        self.parts:list[UploadProcess] = []
+        self.pool:ThreadPoolExecutor = None
+        try:
+            if (resume):
+                for entry in resume["parts"]:
+                    self.parts.append(UploadProcess.from_journal(entry, user, session=self.session))
+            else:
+                for offset in range(0, self.file_size, size):
+                    self.parts.append(UploadProcess(firebase_bucket, user, f"{file_name}.part{len(self.parts)}", file, session=self.session, offset=offset, length=min(size, self.file_size - offset)))
+        except Exception:
+            self.close()
+            raise
+        self.estimate_burst(0, 0)
+        self.pool = ThreadPoolExecutor(max_workers=max(1, len(self.parts)), thread_name_prefix=f"upload-{self.process_id}")
+
+    @classmethod
+    def from_journal(cls, entry:dict, user:User, session:requests.Session=None):
+        process = cls(entry["bucket"], user, entry["file_name"], entry["file"], session=session, resume=entry)
+        process.context = entry.get("context")
+        process.staged = entry.get("staged", False)
+        return process
+
+    def journal_entry(self) -> dict:
+        entry = super().journal_entry()
+        entry.update({"bucket":self.firebase_bucket, "file":self.file, "source_size":self.file_size, "mtime":self.mtime, "parts":[part.journal_entry() for part in self.parts], "staged":self.staged})
+        return entry
+
+    def object_name(self) -> str:
+        return f"files/{self.user.localId}/{self.file_name}"
+
+    def estimate_burst(self, transferred:int, total:int):
+        """Ticks left are those of the slowest part, since every part advances each tick."""
+        self.burst_time = max((part.burst_time for part in self.parts), default=0)
+        self.original_burst_time = self.chunks_done + self.burst_time
+
+    def process(self):
+        pending = [part for part in self.parts if (not part.is_completed())]
+        list(self.pool.map(lambda part: part.process(), pending))
+        self.current_uploaded = sum(part.current_uploaded for part in self.parts)
+        super().process()
+        self.estimate_burst(self.current_uploaded, self.file_size)
+        if (all(part.is_completed() for part in self.parts)):
+            self.compose()
+            self.delete_parts()
+            self.completed = True
+            self.completed_time = datetime.now().timestamp()
+
+    def compose(self):
+        self.object = UploadProcess.compose(self.session, self.firebase_bucket, [part.object_name() for part in self.parts], self.object_name())
+
+    def delete_parts(self):
+        headers = {"Authorization": UploadProcess.authorization(self.session)}
+        for part in self.parts:
+            try:
+                if (not part.is_completed()):
+                    #Cancels the part's resumable session
+                    self.session.delete(part.upload_url)
+                self.session.delete(f"https://storage.googleapis.com/storage/v1/b/{self.firebase_bucket}/o/{quote(part.object_name(), safe='')}", headers=headers)
+            except requests.RequestException:
+                pass
+
+    def is_completed(self) -> bool:
+        return self.completed
+
+    def close(self):
+        for part in self.parts:
+            part.close()
+        if (self.pool):
+            #Cleanup of a failed or cancelled upload runs off the scheduler lock
+            if (not self.completed):
+                self.pool.submit(self.delete_parts)
+            self.pool.shutdown(wait=False)
+        self.discard_staged()
+
+
+class DeltaUploadProcess(TransferProcess):
+    #Uploads the blocks (delta.blocks) missing from files/<uid>/.blocks/<file_name>/ and composes the file from them;
+    #the blocks stay stored for the next update
+    process_type:str = "delta upload"
+    #Bytes of new blocks uploaded per tick
+    chunk_size:int = 4194304
+    min_chunk_size:int = 262144
+    max_chunk_size:int = 67108864
+    max_sources:int = 32
+    max_parallel:int = 8
+    current_uploaded:int = 0
+    completed:bool = False
+    object:dict = None
+
+    def __init__(self, firebase_bucket:str, user:User, file_name:str, file:str, session:requests.Session=None, previous:list[list]=None, resume:dict=None):
+        super().__init__(user)
+        self.session = session if (session) else shared_session()
+        self.firebase_bucket = firebase_bucket
+        self.file_name = file_name
+        self.file = file
+        self.fh = open(file, 'rb')
+        stat = os.fstat(self.fh.fileno())
+        self.file_size = stat.st_size
+        self.mtime = stat.st_mtime
+        if (resume):
+            try:
+                self.verify_source(resume, stat)
+            except Exception:
+                self.fh.close()
+                raise
+        self.view = FileView(self.fh.fileno(), self.file_size)
+        self.pool:ThreadPoolExecutor = None
+        self.blocks:list[Block] = []
+        self.pending:list[Block] = []
+        self.queued:set[str] = set()
+        if (resume):
+            #Block objects named in uploaded are already stored
+            self.uploaded = set(resume["uploaded"])
+            for signature in resume["blocks"]:
+                self.add_block(Block.from_signature(signature))
+            self.scanner = blocks(self.view, start=self.scanned()) if (not resume.get("scanned")) else None
+        else:
+            previous = previous if (previous) else []
+            self.uploaded = {signature[0] for signature in previous}
+            self.scanner = blocks(self.view, previous=[Block.from_signature(signature) for signature in previous])
+        self.estimate_burst(0, 0)
+        self.pool = ThreadPoolExecutor(max_workers=self.max_parallel, thread_name_prefix=f"delta-{self.process_id}")
+
+    @classmethod
+    def from_journal(cls, entry:dict, user:User, session:requests.Session=None):
+        process = cls(entry["bucket"], user, entry["file_name"], entry["file"], session=session, resume=entry)
+        process.context = entry.get("context")
+        return process
+
+    def journal_entry(self) -> dict:
+        entry = super().journal_entry()
+        entry.update({"bucket":self.firebase_bucket, "file":self.file, "source_size":self.file_size, "mtime":self.mtime,
+                      "blocks":[block.signature() for block in self.blocks], "scanned":self.scanner is None, "uploaded":sorted(self.uploaded)})
+        return entry
+
+    def object_name(self) -> str:
+        return f"files/{self.user.localId}/{self.file_name}"
+
+    @staticmethod
+    def block_root(user:User, file_name:str) -> str:
+        return f"files/{user.localId}/.blocks/{file_name}"
+
+    def block_name(self, digest:str) -> str:
+        return f"{self.block_root(self.user, self.file_name)}/{digest}"
+
+    def digests(self) -> list[str]:
+        """Block digests of the uploaded version, in file order."""
+        return [block.digest for block in self.blocks]
+
+    def signatures(self) -> list[list]:
+        """Digest, offset and length of every block, for cutting the next version."""
+        return [block.signature() for block in self.blocks]
+
+    def scanned(self) -> int:
+        return self.blocks[-1].offset + self.blocks[-1].length if (self.blocks) else 0
+
+    def add_block(self, block:Block):
+        self.blocks.append(block)
+        if (block.digest not in self.uploaded and block.digest not in self.queued):
+            self.queued.add(block.digest)
+            self.pending.append(block)
+
+    def scan(self):
+        """Cuts blocks for up to target_chunk_time; the hash runs in Python, so a large file takes many ticks."""
+        deadline = time.monotonic() + self.target_chunk_time
+        for block in self.scanner:
+            self.add_block(block)
+            if (time.monotonic() >= deadline):
+                return
+        self.scanner = None
+
+    def estimate_burst(self, transferred:int, total:int):
+        """Ticks for the missing blocks and the bytes not cut yet at the current bytes per tick, plus one for composing."""
+        pending = sum(block.length for block in self.pending)
+        unscanned = self.file_size - self.scanned() if (self.scanner) else 0
+        self.burst_time = math.ceil((pending + unscanned) / self.chunk_size) + 1
+        self.original_burst_time = self.chunks_done + self.burst_time
+
+    def process(self):
+        if (self.scanner and sum(block.length for block in self.pending) < self.chunk_size):
+            self.scan()
+            super().process()
+            self.estimate_burst(0, 0)
+        elif (self.pending):
+            count = 1
+            size = self.pending[0].length
+            while (count < len(self.pending) and size + self.pending[count].length <= self.chunk_size):
+                size += self.pending[count].length
+                count += 1
+            batch = self.pending[:count]
+            start = time.monotonic()
+            list(self.pool.map(self.upload_block, batch))
+            self.pending = self.pending[count:]
+            self.uploaded.update(block.digest for block in batch)
+            self.current_uploaded += size
+            super().process()
+            self.adapt_chunk_size(time.monotonic() - start, 0, 0)
+        else:
+            self.compose()
+            self.delete_blocks(self.session, self.firebase_bucket, self.user, self.file_name, keep={self.block_name(digest) for digest in self.digests()})
+            self.completed = True
+            self.completed_time = datetime.now().timestamp()
+
+    def upload_block(self, block:Block):
+        url = f"https://storage.googleapis.com/upload/storage/v1/b/{self.firebase_bucket}/o?uploadType=media&name={quote(self.block_name(block.digest), safe='')}"
+        headers = {
+            "Authorization": UploadProcess.authorization(self.session),
+            "Content-Type": "application/octet-stream"
+        }
+        result = self.session.post(url, headers=headers, data=self.view[block.offset:block.offset + block.length])
+        if (not result.ok):
+            raise Exception(f"Failed to upload block {block.digest} of {self.file_name}: {result.status_code}")
+
+    def compose(self):
+        """Composes the object from its blocks, through intermediate objects when there are more than 32."""
+        sources = [self.block_name(block.digest) for block in self.blocks]
+        level = 0
+        while (len(sources) > self.max_sources):
+            groups = [sources[i:i + self.max_sources] for i in range(0, len(sources), self.max_sources)]
+            names = [f"{self.block_root(self.user, self.file_name)}/.compose-{self.process_id}-{level}-{i}" for i in range(len(groups))]
+            list(self.pool.map(lambda group, name: UploadProcess.compose(self.session, self.firebase_bucket, group, name), groups, names))
+            sources = names
+            level += 1
+        self.object = UploadProcess.compose(self.session, self.firebase_bucket, sources, self.object_name())
+
+    @classmethod
+    def delete_blocks(cls, session:requests.Session, firebase_bucket:str, user:User, file_name:str, keep:set[str]=frozenset()):
+        """Deletes the file's block objects that aren't in keep, including those left behind by other clients."""
+        url = f"https://storage.googleapis.com/storage/v1/b/{firebase_bucket}/o"
+        headers = {"Authorization": UploadProcess.authorization(session)}
+        params = {"prefix": f"{cls.block_root(user, file_name)}/", "fields": "items(name),nextPageToken"}
+        try:
+            while (True):
+                result = session.get(url, headers=headers, params=params)
+                if (not result.ok):
+                    return
+                listing = result.json()
+                for item in listing.get("items", []):
+                    if (item["name"] not in keep):
+                        session.delete(f"{url}/{quote(item['name'], safe='')}", headers=headers)
+                if (not listing.get("nextPageToken")):
+                    return
+                params["pageToken"] = listing["nextPageToken"]
+        except (requests.RequestException, ValueError):
+            pass
+
+    def is_completed(self) -> bool:
+        return self.completed
+
+    def close(self):
+        self.scanner = None
+        self.view = b''
+        self.fh.close()
+        if (self.pool):
+            self.pool.shutdown(wait=False)
+
+class ProcessQueue:
+    """FIFO queue for the FCFS and RR levels with O(1) append, pop from the front and removal by process."""
+
+    def __init__(self):
+        self.processes:OrderedDict[int, Process] = OrderedDict()
+
+    def append(self, process:Process):
+        self.processes[process.process_id] = process
+
+    def pop(self) -> Process:
+        return self.processes.popitem(last=False)[1]
+
+    def peek(self) -> Process:
+        return next(iter(self.processes.values()), None)
+
+    def remove(self, process:Process):
+        self.processes.pop(process.process_id, None)
+
+    def __contains__(self, process:Process) -> bool:
+        return process.process_id in self.processes
+
+    def __iter__(self):
+        return iter(list(self.processes.values()))
+
+    def __len__(self) -> int:
+        return len(self.processes)
+
+
+class SRTFQueue:
+    """Min-heap keyed by remaining burst time for the SRTF level.
+
+    Removed entries are only marked and skipped when they reach the top, so removal and
+    decrease-key (remove + push) are O(log n); ties keep their arrival order.
+    """
+
+    def __init__(self):
+        self.heap:list[list] = []
+        self.entries:dict[int, list] = {}
+        self.counter = itertools.count()
+
+    def append(self, process:Process):
+        self.remove(process)
+        entry = [process.burst_time, next(self.counter), process]
+        self.entries[process.process_id] = entry
+        heapq.heappush(self.heap, entry)
+
+    def update(self, process:Process):
+        if (process in self):
+            self.append(process)
+
+    def pop(self) -> Process:
+        while (self.heap):
+            process = heapq.heappop(self.heap)[-1]
+            if (process is not None):
+                del self.entries[process.process_id]
+                return process
+        raise IndexError("pop from an empty queue")
+
+    def peek(self) -> Process:
+        while (self.heap and self.heap[0][-1] is None):
+            heapq.heappop(self.heap)
+        return self.heap[0][-1] if (self.heap) else None
+
+    def remove(self, process:Process):
+        entry = self.entries.pop(process.process_id, None)
+        if (entry):
+            entry[-1] = None
+
+    def __contains__(self, process:Process) -> bool:
+        return process.process_id in self.entries
+
+    def __iter__(self):
+        return iter([entry[-1] for entry in self.entries.values()])
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
 
 class Computer:
     logger = logging.getLogger("Computer")
-    multi_level_scheduling:dict[int, dict[str, list[Process]]] = {
-        1:{"queue":[]}, #FCFS
-        2:{"queue":[]}, #RR
-        3:{"queue":[]}  #SRTF
-    }
+    multi_level_scheduling:dict[int, dict[str, ProcessQueue | SRTFQueue]]
     settings:dict = {
-        "aging_time":10,
+        "aging_time":10, #seconds a process waits in a queue before moving up a level
+        "stats_interval":60,
         "time_quantum":3,
-        "lower_priority_time":5
+        "lower_priority_time":5,
+        "journal_interval":1 #seconds between journal writes for one transfer
     }
+    #Classes that can be rebuilt from a transfer journal entry, by process_type
+    transfer_types:dict[str, type] = {process_class.process_type: process_class for process_class in (DownloadProcess, SegmentedDownloadProcess, UploadProcess, CompositeUploadProcess, DeltaUploadProcess)}
     stats:list[tuple]
-    current_process:Process = None
     start_time:int = 0
 
-    def __init__(self):
+    def __init__(self, workers:int=1, level_limits:dict[int, int]=None, pool_size:int=None):
         logging.basicConfig(handlers=[logging.FileHandler("output.log", 'w')])
         self.logger.setLevel(logging.DEBUG)
+        self.multi_level_scheduling = {
+            1:{"queue":ProcessQueue()}, #FCFS
+            2:{"queue":ProcessQueue()}, #RR
+            3:{"queue":SRTFQueue()}     #SRTF
+        }
         self.stats = []
         self.stat_offset = 0
+        #Min-heap of (due time, tie breaker, process, queue token) for pending promotions
+        self.aging_heap:list[tuple] = []
+        self.aging_counter = itertools.count()
+        #Number of worker slots and the max processes of each priority level running at once
+        self.workers = max(1, workers)
+        self.level_limits = level_limits if (level_limits) else {}
+        self.running:dict[int, Process] = {}
+        #Keep-alive connection pool shared by every transfer this computer runs
+        self.session = create_session(pool_size=pool_size if (pool_size) else max(10, self.workers * 2))
+        self.journal = TransferJournal()
+        #Runs the futures' done callbacks off the worker slots
+        self.callbacks = ThreadPoolExecutor(max_workers=max(2, self.workers), thread_name_prefix="Computer-callbacks")
+        #Guards the queues and running slots; add_process notifies idle workers and enqueue the timer
+        self.lock = threading.Lock()
+        self.work_available = threading.Condition(self.lock)
+        self.timer_wakeup = threading.Condition(self.lock)
+
+    def add_process(self, process:Process) -> Future:
+        """Queues the process; the returned future resolves with it on completion, or with its error.
 
-    def add_process(self, process:Process):
+        Cancelling the future cancels the process.
+        """
+        process.future = Future()
+        process.future.add_done_callback(lambda future: self.cancel_process(process) if (future.cancelled()) else None)
+        self.record_progress(process)
+        with self.lock:
+            self.enqueue(process)
+            self.logger.info(f"Process {process.process_id} type {process.process_type} added to priority {process.priority} queue.")
+            self.work_available.notify()
+        return process.future
+
+    def enqueue(self, process:Process):
+        """Queues the process at its priority and schedules its promotion; called with self.lock held."""
+        process.enqueued_time = datetime.now().timestamp()
+        process.queue_token += 1
         self.multi_level_scheduling[process.priority]["queue"].append(process)
-        self.logger.info(f"Process {process.process_id} type {process.process_type} added to priority {process.priority} queue.")
+        if (process.priority > 1):
+            due = process.enqueued_time + self.settings.get("aging_time")
+            heapq.heappush(self.aging_heap, (due, next(self.aging_counter), process, process.queue_token))
+            #Requeues after a quantum or preemption also add entries, and the timer may be waiting with no timeout
+            self.timer_wakeup.notify()
+
+    def cancel_process(self, process:Process):
+        """Drops a queued process right away; a running one is stopped and closed after its current tick."""
+        with self.lock:
+            if (process.cancelled or process.error or process.is_completed()):
+                return
+            process.cancelled = True
+            if (process in self.running.values()):
+                return
+            self.multi_level_scheduling[process.priority]["queue"].remove(process)
+            process.close()
+            self.forget(process)
+            self.logger.info(f"Process {process.process_id} type {process.process_type} cancelled.")
+        self.resolve(process)
+
+    def resolve(self, process:Process):
+        """Settles the process's future once it has left the scheduler.
+
+        Done callbacks, such as writing metadata or decoding and caching a download, run on the callbacks
+        executor rather than in the worker slot, so they never hold up other transfers.
+        """
+        if (process.future and not process.future.done()):
+            self.callbacks.submit(self.settle, process)
+
+    def settle(self, process:Process):
+        if (process.future.done()):
+            return
+        if (process.error):
+            process.future.set_exception(process.error)
+        elif (process.cancelled):
+            process.future.cancel()
+        elif (process.is_completed()):
+            process.future.set_result(process)
+
+    def has_queued(self) -> bool:
+        return any(self.multi_level_scheduling[priority]["queue"] for priority in range(1, 4))
+
+    def running_at(self, priority:int) -> int:
+        return sum(1 for process in self.running.values() if process.priority == priority)
+
+    def can_select(self, priority:int) -> bool:
+        limit = self.level_limits.get(priority)
+        return bool(self.multi_level_scheduling[priority]["queue"]) and (limit is None or self.running_at(priority) < limit)
+
+    def promote_due(self) -> float:
+        """Moves every process whose wait has reached aging_time up a level; returns the next due time or None."""
+        now = datetime.now().timestamp()
+        aged = False
+        while (self.aging_heap and self.aging_heap[0][0] <= now):
+            _, _, process, token = heapq.heappop(self.aging_heap)
+            #Entries for processes that were selected or requeued since are stale
+            if (token != process.queue_token or process not in self.multi_level_scheduling[process.priority]["queue"]):
+                continue
+            self.multi_level_scheduling[process.priority]["queue"].remove(process)
+            process.increase_priority()
+            self.enqueue(process)
+            self.logger.info(f"Process {process.process_id} type {process.process_type} aged to priority {process.priority}.")
+            aged = True
+        if (aged):
+            #A level that was at its limit may have a free slot for the aged process
+            self.work_available.notify_all()
+        return self.aging_heap[0][0] if (self.aging_heap) else None
 
     def run(self):
+        for slot in range(self.workers):
+            threading.Thread(target=self.work, args=(slot,), daemon=True, name=f"Computer-worker-{slot}").start()
+
+        #Timer for aging: sleeps until the next promotion is due, or until enqueue adds an entry
+        with self.lock:
+            while True:
+                due = self.promote_due()
+                if (due is None):
+                    self.logger.debug("No processes waiting to age, waiting for work.")
+                    self.timer_wakeup.wait()
+                else:
+                    self.timer_wakeup.wait(timeout=max(0, due - datetime.now().timestamp()))
+
+    def work(self, slot:int):
+        process = None
         while True:
+            if (process):
+                with self.lock:
+                    next_process = self.schedule_after_tick(process)
+                    if (not next_process):
+                        self.running.pop(slot, None)
+                if (not next_process):
+                    self.resolve(process)
+                process = next_process
+
+            if (not process):
+                with self.lock:
+                    while (not process):
+                        process = self.select_from_mlfq()
+                        if (not process):
+                            self.work_available.wait()
+                    self.running[slot] = process
+
+            #Processing outside the lock so the other slots and add_process never wait on I/O
+            try:
+                process.process()
+            except Exception as e:
+                process.error = e
+            self.record_progress(process)
+
+    def record_progress(self, process:Process):
+        """Writes a transfer's resumable state to the journal, at most once per journal_interval."""
+        now = datetime.now().timestamp()
+        if (now - process.journaled_time < self.settings.get("journal_interval") or process.error or process.cancelled or process.is_completed()):
+            return
+        entry = process.journal_entry()
+        if (entry is not None):
+            self.journal.record(process.journal_key(), entry)
+            process.journaled_time = now
+
+    def forget(self, process:Process):
+        if (process.journal_entry() is not None):
+            self.journal.remove(process.journal_key())
+
+    def resume_transfers(self, user:User) -> list[Process]:
+        """Re-enqueues the user's journaled transfers, each continuing from its last confirmed byte."""
+        processes = []
+        for entry in self.journal.entries(user.localId):
+            process_class = self.transfer_types.get(entry.get("type"))
+            try:
+                process = process_class.from_journal(entry, user, session=self.session)
+            except Exception as e:
+                self.logger.error(f"Could not resume {entry.get('type')} of {entry.get('file_name')}: {e}")
+                self.journal.remove(TransferJournal.key(entry.get("user"), entry.get("type"), entry.get("file_name")))
+                if (entry.get("staged")):
+                    #The staged copy was made for this upload only
+                    try:
+                        os.remove(entry["file"])
+                    except OSError:
+                        pass
+                continue
+            self.logger.info(f"Process {process.process_id} type {process.process_type} resumed with {process.burst_time} chunks left.")
+            self.add_process(process)
+            processes.append(process)
+        return processes
+
+    def preempt(self, process:Process, reason:str):
+        self.logger.info(f"Process {process.process_id} type {process.process_type} {reason}.")
+        if (process.sub_processed_time >= self.settings.get("lower_priority_time")):
+            process.decrease_priority()
+            self.logger.info(f"Process {process.process_id} type {process.process_type} lower to priority {process.priority}")
+        self.enqueue(process)
+
+    def schedule_after_tick(self, process:Process) -> Process:
+        """Decides whether the slot keeps its process for another tick; returns None when the slot frees up."""
+        if (process.error):
+            self.logger.error(f"Process {process.process_id} type {process.process_type} failed: {process.error}")
+            process.close()
+            self.forget(process)
+        elif (process.cancelled):
+            self.logger.info(f"Process {process.process_id} type {process.process_type} cancelled.")
+            process.close()
+            self.forget(process)
+        elif (process.is_completed()):
+            self.logger.info(f"Process {process.process_id} type {process.process_type} finished processing")
+            turn_around_time = process.completed_time - process.arrival_time
+            waiting_time = turn_around_time - process.original_burst_time
             #Resets stats every minute
-            if (datetime.now().timestamp() - self.stat_offset >= 60 * 1):
+            if (process.completed_time - self.stat_offset >= self.settings.get("stats_interval")):
                 self.stats.clear()
-                self.stat_offset = datetime.now().timestamp()
-
-            #Waiting and Aging
-            for priority in range(1, 4):
-                for process in self.multi_level_scheduling[priority]["queue"]:
-                    process.wait()
-                    if (process.sub_wait_time >= self.settings.get("aging_time") and process.priority > 1):
-                        process.increase_priority()
-                        self.multi_level_scheduling[priority]["queue"].remove(process)
-                        self.multi_level_scheduling[process.priority]["queue"].append(process)
-                        self.logger.info(f"Process {process.process_id} type {process.process_type} aged to priority {process.priority}.")
-            
-            #Processing the current process
-            if (self.current_process):
-                self.current_process.process()
-                if (self.current_process.is_completed()):
-                    self.logger.info(f"Process {self.current_process.process_id} type {self.current_process.process_type} finished processing")
-                    turn_around_time = self.current_process.completed_time - self.current_process.arrival_time
-                    waiting_time = turn_around_time - self.current_process.original_burst_time
-                    self.stats.append((self.current_process.arrival_time, turn_around_time, waiting_time))
-                    self.current_process = self.select_from_mlfq()
-                elif (self.current_process.priority == 3):
-                    if (self.multi_level_scheduling[2]["queue"] or self.multi_level_scheduling[1]["queue"]):
-                        self.logger.info(f"Process {self.current_process.process_id} type {self.current_process.process_type} preempted.")
-                        if (self.current_process.sub_processed_time >= self.settings.get("lower_priority_time")):
-                            self.current_process.decrease_priority()
-                            self.logger.info(f"Process {self.current_process.process_id} type {self.current_process.process_type} lower to priority {self.current_process.priority}")
-                        self.multi_level_scheduling[self.current_process.priority]["queue"].append(self.current_process)
-                        self.current_process = self.select_from_mlfq()
-                    elif (self.multi_level_scheduling[3]["queue"]):
-                        self.multi_level_scheduling[3]["queue"].sort(key=lambda p: p.burst_time)
-                        if (self.multi_level_scheduling[3]["queue"][0].burst_time < self.current_process.burst_time):
-                            self.logger.info(f"Process {self.current_process.process_id} type {self.current_process.process_type} preempted.")
-                            if (self.current_process.sub_processed_time >= self.settings.get("lower_priority_time")):
-                                self.current_process.decrease_priority()
-                                self.logger.info(f"Process {self.current_process.process_id} type {self.current_process.process_type} lower to priority {self.current_process.priority}")
-                            self.multi_level_scheduling[self.current_process.priority]["queue"].append(self.current_process)
-                            self.current_process = self.select_from_mlfq()
-                elif (self.current_process.priority == 2):
-                    if (self.current_process.sub_processed_time % self.settings.get("time_quantum") == 0):
-                        self.logger.info(f"Process {self.current_process.process_id} type {self.current_process.process_type} time quantum expired.")
-                        if (self.current_process.sub_processed_time >= self.settings.get("lower_priority_time")):
-                            self.current_process.decrease_priority()
-                            self.logger.info(f"Process {self.current_process.process_id} type {self.current_process.process_type} lower to priority {self.current_process.priority}")
-                        self.multi_level_scheduling[self.current_process.priority]["queue"].append(self.current_process)
-                        self.current_process = self.select_from_mlfq()
+                self.stat_offset = process.completed_time
+            self.stats.append((process.arrival_time, turn_around_time, waiting_time))
+            process.close()
+            self.forget(process)
+        elif (process.priority == 3):
+            if (self.can_select(2) or self.can_select(1)):
+                self.preempt(process, "preempted")
+            elif (self.multi_level_scheduling[3]["queue"]):
+                if (self.multi_level_scheduling[3]["queue"].peek().burst_time < process.burst_time):
+                    self.preempt(process, "preempted")
+                else:
+                    return process
             else:
-                self.current_process = self.select_from_mlfq()
+                return process
+        elif (process.priority == 2):
+            if (process.sub_processed_time % self.settings.get("time_quantum") == 0):
+                self.preempt(process, "time quantum expired")
+            else:
+                return process
+        else:
+            return process
+
+        self.work_available.notify_all()
+        return None
     
     def select_from_mlfq(self) -> Process:
+        self.promote_due()
         for priority in range(1, 4):
-            queue = self.multi_level_scheduling[priority]["queue"]
-            if (len(queue) > 0):
-                process = queue.pop(0)
+            if (self.can_select(priority)):
+                process = self.multi_level_scheduling[priority]["queue"].pop()
                 self.logger.info(f"Process {process.process_id} type {process.process_type} selected from priority {priority} queue.")
-                process.sub_wait_time = 0
                 return process
         return None
-
-
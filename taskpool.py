@@ -0,0 +1,90 @@
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from typing import Callable
+import threading
+
+_shared_pool = None
+_shared_lock = threading.Lock()
+
+
+class TaskPoolFull(Exception):
+    pass
+
+
+class TaskPool(Executor):
+    """Fixed-size thread pool with a bounded backlog.
+
+    At most max_workers tasks run and max_queue more wait; submit() blocks for a free slot and
+    try_submit() gives up after a timeout. A task that submits more work never blocks: waiting for
+    a slot only its own pool can free would deadlock once every worker did it, so submit() raises
+    TaskPoolFull there instead. The returned futures can be awaited, and cancelled while they are
+    still waiting.
+    """
+
+    def __init__(self, max_workers:int=8, max_queue:int=64, name:str="tasks"):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self.slots = threading.BoundedSemaphore(max_workers + max_queue)
+        self.lock = threading.Lock()
+        self.waiting = 0
+        #Marks this pool's worker threads
+        self.local = threading.local()
+
+    @property
+    def queue_depth(self) -> int:
+        """Tasks submitted but not yet started."""
+        with self.lock:
+            return self.waiting
+
+    def in_worker(self) -> bool:
+        return getattr(self.local, "worker", False)
+
+    def submit(self, function:Callable, /, *args, **kwargs) -> Future:
+        if (self.in_worker()):
+            if (not self.slots.acquire(blocking=False)):
+                raise TaskPoolFull(f"Task queue is full ({self.queue_depth} waiting)")
+        else:
+            self.slots.acquire()
+        return self.start(function, args, kwargs)
+
+    def try_submit(self, function:Callable, /, *args, timeout:float=0, **kwargs) -> Future:
+        if (not self.slots.acquire(timeout=timeout)):
+            raise TaskPoolFull(f"Task queue is full ({self.queue_depth} waiting)")
+        return self.start(function, args, kwargs)
+
+    def start(self, function:Callable, args:tuple, kwargs:dict) -> Future:
+        with self.lock:
+            self.waiting += 1
+
+        def run():
+            self.local.worker = True
+            with self.lock:
+                self.waiting -= 1
+            return function(*args, **kwargs)
+
+        try:
+            future = self.executor.submit(run)
+        except Exception:
+            with self.lock:
+                self.waiting -= 1
+            self.slots.release()
+            raise
+        future.add_done_callback(self.finished)
+        return future
+
+    def finished(self, future:Future):
+        #A task cancelled while waiting never reaches run()
+        if (future.cancelled()):
+            with self.lock:
+                self.waiting -= 1
+        self.slots.release()
+
+    def shutdown(self, wait:bool=True, *, cancel_futures:bool=False):
+        self.executor.shutdown(wait=wait, cancel_futures=cancel_futures)
+
+
+def shared_pool() -> TaskPool:
+    """Process-wide pool for background work from Firebase and the editor."""
+    global _shared_pool
+    with _shared_lock:
+        if (_shared_pool is None):
+            _shared_pool = TaskPool()
+        return _shared_pool
@@ -0,0 +1,146 @@
+from cloudlock import CloudLease, CloudLockHeld
+from objects import User
+import unittest
+import threading
+import hashlib
+import time
+import json
+
+
+class FakeResponse:
+    def __init__(self, status_code:int, value, etag:str):
+        self.status_code = status_code
+        self.ok = 200 <= status_code < 300
+        self.value = value
+        self.headers = {'ETag':etag}
+
+    def json(self):
+        return self.value
+
+
+class FakeRTDB:
+    """Stand-in for the Realtime Database REST API: values by URL, with ETags and if-match writes."""
+
+    def __init__(self):
+        self.values = {}
+        self.lock = threading.Lock()
+        #Called with the URL before a conditional write is checked, to let another client get in first
+        self.before_write = None
+
+    @staticmethod
+    def etag(value) -> str:
+        return hashlib.md5(json.dumps(value, sort_keys=True).encode()).hexdigest()
+
+    def get(self, url:str, params:dict=None, headers:dict=None) -> FakeResponse:
+        with self.lock:
+            value = self.values.get(url)
+            return FakeResponse(200, value, self.etag(value))
+
+    def put(self, url:str, params:dict=None, headers:dict=None, data:str=None) -> FakeResponse:
+        if (self.before_write):
+            hook, self.before_write = self.before_write, None
+            hook(url)
+        with self.lock:
+            current = self.values.get(url)
+            if (headers.get('if-match') != self.etag(current)):
+                return FakeResponse(412, current, self.etag(current))
+            value = json.loads(data)
+            if (value is None):
+                self.values.pop(url, None)
+            else:
+                self.values[url] = value
+            return FakeResponse(200, value, self.etag(value))
+
+
+class CloudLeaseTest(unittest.TestCase):
+    def setUp(self):
+        self.rtdb = FakeRTDB()
+        self.user = User("owner@example.com", "password")
+        self.user.setup_account({'localId':'uid', 'idToken':'token'})
+        self.leases = []
+
+    def tearDown(self):
+        for lease in self.leases:
+            lease.stopped.set()
+
+    def lease(self, ttl:float=60) -> CloudLease:
+        lease = CloudLease("https://rtdb.example", self.user, "documents/notes.txt", session=self.rtdb, ttl=ttl)
+        lease.poll_interval = 0.01
+        self.leases.append(lease)
+        return lease
+
+    def stored(self) -> dict:
+        return self.rtdb.values.get(self.leases[0].url())
+
+    def test_acquire_and_release(self):
+        lease = self.lease().acquire()
+        self.assertTrue(lease.held)
+        self.assertEqual(self.stored()['owner'], lease.owner)
+        lease.release()
+        self.assertFalse(lease.held)
+        self.assertIsNone(self.stored())
+
+    def test_held_lease_blocks_others(self):
+        holder = self.lease().acquire()
+        with self.assertRaises(CloudLockHeld):
+            self.lease().acquire(timeout=0.05)
+        self.assertEqual(self.stored()['owner'], holder.owner)
+
+    def test_lost_race_is_refused(self):
+        rival = self.lease()
+        contender = self.lease()
+        #The rival's write lands between the contender's read and its conditional write
+        self.rtdb.before_write = lambda url: rival.acquire()
+        with self.assertRaises(CloudLockHeld):
+            contender.acquire()
+        self.assertEqual(self.stored()['owner'], rival.owner)
+
+    def test_write_retried_after_412(self):
+        contender = self.lease()
+        url = contender.url()
+        self.rtdb.values[url] = {'owner':'gone', 'expires':time.time() - 1}
+
+        def rewrite(url):
+            #Another client's change to an expired lock only moves the ETag
+            self.rtdb.values[url] = {'owner':'also gone', 'expires':time.time() - 1}
+        self.rtdb.before_write = rewrite
+        contender.acquire()
+        self.assertEqual(self.stored()['owner'], contender.owner)
+
+    def test_waits_for_release(self):
+        holder = self.lease().acquire()
+        threading.Timer(0.05, holder.release).start()
+        waiter = self.lease().acquire(timeout=2)
+        self.assertEqual(self.stored()['owner'], waiter.owner)
+
+    def test_renewal_extends_lease(self):
+        lease = self.lease(ttl=0.3).acquire()
+        first = self.stored()['expires']
+        time.sleep(0.5)
+        self.assertTrue(lease.held)
+        self.assertGreater(self.stored()['expires'], first)
+        with self.assertRaises(CloudLockHeld):
+            self.lease().acquire()
+
+    def test_takeover_after_expiry(self):
+        crashed = self.lease(ttl=0.1).acquire()
+        #A crashed client stops renewing
+        crashed.stopped.set()
+        with self.assertRaises(CloudLockHeld):
+            self.lease().acquire()
+        time.sleep(0.15)
+        taker = self.lease().acquire()
+        self.assertEqual(self.stored()['owner'], taker.owner)
+        self.assertFalse(crashed.renew())
+
+    def test_release_leaves_other_owner(self):
+        stale = self.lease(ttl=0.1).acquire()
+        stale.stopped.set()
+        time.sleep(0.15)
+        taker = self.lease().acquire()
+        stale.release()
+        self.assertEqual(self.stored()['owner'], taker.owner)
+
+
+if __name__ == "__main__":
+    unittest.main()
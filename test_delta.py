@@ -0,0 +1,168 @@
+from delta import Block, blocks
+from scheduling import DeltaUploadProcess, UploadProcess
+from objects import User
+from urllib.parse import unquote, urlparse, parse_qs
+from unittest import mock
+import unittest
+import tempfile
+import random
+import os
+
+
+class FakeResponse:
+    def __init__(self, status_code:int, value=None):
+        self.status_code = status_code
+        self.ok = 200 <= status_code < 300
+        self.value = value
+        self.headers = {}
+
+    def json(self):
+        return self.value
+
+
+class FakeGCS:
+    """Stand-in for the Cloud Storage JSON API: media uploads, compose, listing by prefix and deletes."""
+
+    def __init__(self):
+        self.objects = {}
+        self.uploads = []
+        self.composes = []
+        self.deletes = []
+
+    @staticmethod
+    def object_name(url:str) -> str:
+        return unquote(urlparse(url).path.split("/o/", 1)[1])
+
+    def post(self, url:str, headers:dict=None, data=None, json:dict=None) -> FakeResponse:
+        if ("uploadType=media" in url):
+            name = parse_qs(urlparse(url).query)["name"][0]
+            self.objects[name] = bytes(data)
+            self.uploads.append(name)
+            return FakeResponse(200, {"name":name})
+        destination = self.object_name(url)[:-len("/compose")]
+        sources = [source["name"] for source in json["sourceObjects"]]
+        self.composes.append((destination, sources))
+        self.objects[destination] = b"".join(self.objects[name] for name in sources)
+        return FakeResponse(200, {"name":destination, "generation":"1"})
+
+    def get(self, url:str, headers:dict=None, params:dict=None) -> FakeResponse:
+        return FakeResponse(200, {"items":[{"name":name} for name in self.objects if name.startswith(params["prefix"])]})
+
+    def delete(self, url:str, headers:dict=None) -> FakeResponse:
+        name = self.object_name(url)
+        self.deletes.append(name)
+        self.objects.pop(name, None)
+        return FakeResponse(204)
+
+
+class BlocksTest(unittest.TestCase):
+    def setUp(self):
+        self.random = random.Random(0)
+        self.data = self.random.randbytes(3 * 1048576)
+        self.previous = list(blocks(self.data))
+
+    def assertReused(self, new:bytes):
+        """Cutting new with the previous blocks gives what a full pass gives."""
+        reused = list(blocks(new, previous=self.previous))
+        full = list(blocks(new))
+        self.assertEqual([block.signature() for block in reused], [block.signature() for block in full])
+        self.assertEqual(sum(block.length for block in reused), len(new))
+        return reused
+
+    def unchanged(self, cut:list[Block]) -> int:
+        digests = {block.digest for block in self.previous}
+        return sum(1 for block in cut if (block.digest in digests))
+
+    def test_full_pass_covers_file(self):
+        offset = 0
+        for block in self.previous:
+            self.assertEqual(block.offset, offset)
+            offset += block.length
+        self.assertEqual(offset, len(self.data))
+        self.assertGreater(len(self.previous), 2)
+
+    def test_insert(self):
+        at = len(self.data) // 3
+        cut = self.assertReused(self.data[:at] + self.random.randbytes(1000) + self.data[at:])
+        self.assertGreaterEqual(self.unchanged(cut), len(self.previous) - 2)
+
+    def test_delete(self):
+        at = len(self.data) // 2
+        cut = self.assertReused(self.data[:at] + self.data[at + 5000:])
+        self.assertGreaterEqual(self.unchanged(cut), len(self.previous) - 2)
+
+    def test_edit(self):
+        at = len(self.data) // 2
+        cut = self.assertReused(self.data[:at] + self.random.randbytes(100) + self.data[at + 100:])
+        self.assertGreaterEqual(self.unchanged(cut), len(self.previous) - 2)
+
+    def test_append(self):
+        cut = self.assertReused(self.data + self.random.randbytes(70000))
+        self.assertGreaterEqual(self.unchanged(cut), len(self.previous) - 1)
+
+    def test_truncate(self):
+        cut = self.assertReused(self.data[:len(self.data) - 200000])
+        self.assertGreaterEqual(self.unchanged(cut), len(self.previous) - 2)
+
+    def test_unchanged(self):
+        cut = self.assertReused(self.data)
+        self.assertEqual(self.unchanged(cut), len(self.previous))
+
+
+class DeltaUploadProcessTest(unittest.TestCase):
+    def setUp(self):
+        self.gcs = FakeGCS()
+        self.user = User("owner@example.com", "password")
+        self.user.setup_account({'localId':'uid', 'idToken':'token'})
+        authorization = mock.patch.object(UploadProcess, "authorization", classmethod(lambda cls, session: "Bearer token"))
+        authorization.start()
+        self.addCleanup(authorization.stop)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "notes.log")
+        self.random = random.Random(0)
+
+    def upload(self, data:bytes, previous:list[list]=None) -> DeltaUploadProcess:
+        with open(self.path, 'wb') as f:
+            f.write(data)
+        self.gcs.uploads, self.gcs.composes, self.gcs.deletes = [], [], []
+        process = DeltaUploadProcess("bucket", self.user, "notes.log", self.path, session=self.gcs, previous=previous)
+        process.max_sources = 4
+        try:
+            while (not process.is_completed()):
+                process.process()
+        finally:
+            process.close()
+        self.assertEqual(self.gcs.objects["files/uid/notes.log"], data)
+        return process
+
+    def block_names(self, process:DeltaUploadProcess) -> set[str]:
+        return {process.block_name(digest) for digest in process.digests()}
+
+    def test_first_upload_stores_every_block(self):
+        process = self.upload(self.random.randbytes(3 * 1048576))
+        self.assertEqual(set(self.gcs.uploads), self.block_names(process))
+        #More than max_sources blocks are composed through intermediate objects, which are deleted afterwards
+        self.assertGreater(len(self.gcs.composes), 1)
+        self.assertTrue(all(len(sources) <= 4 for destination, sources in self.gcs.composes))
+        self.assertEqual(self.gcs.composes[-1][0], "files/uid/notes.log")
+        self.assertTrue(all(".compose-" in name for name in self.gcs.deletes))
+        self.assertEqual({name for name in self.gcs.objects if ("/.blocks/" in name)}, self.block_names(process))
+
+    def test_update_uploads_changed_blocks(self):
+        data = self.random.randbytes(3 * 1048576)
+        first = self.upload(data)
+        #A block left behind by another client's interrupted upload
+        self.gcs.objects["files/uid/.blocks/notes.log/stale"] = b"stale"
+        at = len(data) // 2
+        second = self.upload(data[:at] + self.random.randbytes(100) + data[at + 100:], previous=first.signatures())
+        uploaded = set(self.gcs.uploads)
+        self.assertEqual(uploaded, self.block_names(second) - self.block_names(first))
+        self.assertLessEqual(len(uploaded), 2)
+        self.assertEqual(set(self.gcs.deletes) - {name for name in self.gcs.deletes if (".compose-" in name)},
+                         (self.block_names(first) - self.block_names(second)) | {"files/uid/.blocks/notes.log/stale"})
+        self.assertEqual({name for name in self.gcs.objects if ("/.blocks/" in name)}, self.block_names(second))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,34 @@
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import threading
+import requests
+
+_shared_session:requests.Session = None
+_shared_lock = threading.Lock()
+
+
+def create_session(pool_size:int=10, retries:int=3, backoff:float=0.5) -> requests.Session:
+    """Session with keep-alive connection pooling and retry/backoff on transient errors."""
+    retry = Retry(
+        total=retries,
+        backoff_factor=backoff,
+        status_forcelist=(408, 429, 500, 502, 503, 504),
+        #Chunk PUTs carry a Content-Range and range GETs are idempotent, so every method used here is safe to retry
+        allowed_methods=frozenset(["GET", "HEAD", "PUT", "POST", "DELETE"]),
+        respect_retry_after_header=True,
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def shared_session() -> requests.Session:
+    """Process-wide session used by transfers that were not given one."""
+    global _shared_session
+    with _shared_lock:
+        if (_shared_session is None):
+            _shared_session = create_session()
+        return _shared_session